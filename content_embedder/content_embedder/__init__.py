@@ -1,53 +1,274 @@
+from collections import OrderedDict
+from contextlib import contextmanager
 import markdown
 import os
 import re
 import io
+import threading
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+class FragmentCache(object):
+    # embedded files are shared between pages and between sites, so their
+    # lines, and their fully expanded lines, are kept per process. an entry
+    # is only reused while the mtime and size of every file it was built
+    # from are unchanged. the least recently used entries are dropped beyond
+    # max_entries.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._expanded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, entries, key):
+        with self._lock:
+            entry = entries.pop(key, None)
+            if entry is not None:
+                entries[key] = entry
+            return entry
+
+    def _put(self, entries, key, entry):
+        with self._lock:
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def read(self, path):
+        # returns the file's (mtime, size) stamp and its lines
+        path = os.path.abspath(path)
+        stamp = _stamp(path)
+        entry = self._get(self._entries, path)
+        if entry is not None and entry[0] == stamp:
+            return entry
+        with io.open(path, 'r', encoding='utf-8') as f:
+            entry = (stamp, f.readlines())
+        self._put(self._entries, path, entry)
+        return entry
+
+    def lines(self, path):
+        return self.read(path)[1]
+
+    def expanded(self, path, docs_dir):
+        # the expanded lines of path stored by put_expanded, or None
+        entry = self._get(self._expanded, (os.path.abspath(path), docs_dir))
+        if entry is None:
+            return None
+        stamps, lines = entry
+        try:
+            for dep, stamp in stamps.items():
+                if _stamp(dep) != stamp:
+                    return None
+        except OSError:
+            return None
+        return entry
+
+    def put_expanded(self, path, docs_dir, stamps, lines):
+        # stamps maps every file the expansion read to its stamp
+        self._put(self._expanded, (os.path.abspath(path), docs_dir), (stamps, lines))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expanded.clear()
+
+
+class IncludeGraph(object):
+    # which files each page or fragment embeds, recorded as they are
+    # expanded
+    def __init__(self):
+        self._includes = {}
+        self._included_by = {}
+        self._lock = threading.Lock()
+
+    def record(self, page, paths):
+        page = os.path.abspath(page)
+        paths = set(os.path.abspath(path) for path in paths)
+        with self._lock:
+            for path in self._includes.get(page, ()):
+                self._included_by[path].discard(page)
+            self._includes[page] = paths
+            for path in paths:
+                self._included_by.setdefault(path, set()).add(page)
+
+    def includes(self, page):
+        with self._lock:
+            return set(self._includes.get(os.path.abspath(page), ()))
+
+    def pages_including(self, path):
+        # every page or fragment that embeds path, directly or through
+        # other fragments
+        found = set()
+        with self._lock:
+            pending = [os.path.abspath(path)]
+            while pending:
+                for page in self._included_by.get(pending.pop(), ()):
+                    if page not in found:
+                        found.add(page)
+                        pending.append(page)
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._includes.clear()
+            self._included_by.clear()
+
+
+fragment_cache = FragmentCache()
+include_graph = IncludeGraph()
+
+
+_current = threading.local()
+
+
+@contextmanager
+def rendering_page(page):
+    # tells the embedder which page is being converted on this thread, so
+    # its embeds are recorded in include_graph. mkdocs does not pass the
+    # page to extensions, so build drivers wrap each page's conversion in
+    #     with rendering_page(page_path): ...
+    previous = getattr(_current, 'page', None)
+    _current.page = page
+    try:
+        yield
+    finally:
+        _current.page = previous
 
 
 class ContentEmbedderPattern(markdown.inlinepatterns.Pattern):
-    def __init__ (self, md, docs_dir=None):
+    def __init__ (self, md, docs_dir=None, stream=False):
         markdown.inlinepatterns.Pattern.__init__(self, r'{{(.*)}}')
         self.md = md
         self.docs_dir = docs_dir
+        self.stream = stream
         self.blocks = []
 
-    def handleMatch(self, m):
-        filename = m.group(1).strip()
-        input_path = os.path.join(self.docs_dir, filename)
+    def input_path(self, m):
+        return os.path.join(self.docs_dir, m.group(1).strip())
 
+    def create(self, input_path):
         try:
-            input_content = io.open(input_path, 'r', encoding='utf-8').readlines()
-        except IOError:
-            try:
-                os.makedirs(os.path.dirname(input_path))
-            except OSError:
-                pass
-            with open(input_path, 'w') as f:
-                pass
-            return []
-
-        return input_content
+            os.makedirs(os.path.dirname(input_path))
+        except OSError:
+            pass
+        with open(input_path, 'w') as f:
+            pass
 
-    embedder_re = re.compile(r'{{(.*)}}')
-    def run(self, lines):
-        new_lines = []
+    def read(self, input_path):
+        try:
+            return fragment_cache.read(input_path)
+        except (IOError, OSError):
+            self.create(input_path)
+            return _stamp(input_path), []
+
+    def expand(self, input_path, including=()):
+        # returns the stamps of every file the expansion of input_path read
+        # along with its fully expanded lines. including holds the files
+        # whose expansion led here, to catch include cycles.
+        path = os.path.abspath(input_path)
+        if path in including:
+            raise Exception('content_embedder: include cycle ' + ' -> '.join(including + (path,)))
+        entry = fragment_cache.expanded(path, self.docs_dir)
+        if entry is not None:
+            return entry
+
+        stamp, lines = self.read(input_path)
+        stamps = {path: stamp}
+        expanded = []
+        embedded = []
+        for line in lines:
+            m = '{{' in line and self.embedder_re.match(line)
+            if m:
+                embedded.append(self.input_path(m))
+                child_stamps, child_lines = self.expand(embedded[-1], including + (path,))
+                stamps.update(child_stamps)
+                expanded.extend(child_lines)
+            else:
+                expanded.append(line)
+
+        include_graph.record(path, embedded)
+        fragment_cache.put_expanded(path, self.docs_dir, stamps, expanded)
+        return stamps, expanded
+
+    def expand_lazily(self, input_path, including=()):
+        # like expand, but yields lines as they are read from disk instead of
+        # building a list of them, and leaves fragment_cache alone, so the
+        # expansion is neither copied into an intermediate list nor kept
+        # around for later pages
+        path = os.path.abspath(input_path)
+        if path in including:
+            raise Exception('content_embedder: include cycle ' + ' -> '.join(including + (path,)))
+        try:
+            f = io.open(input_path, 'r', encoding='utf-8')
+        except (IOError, OSError):
+            self.create(input_path)
+            return
+
+        embedded = []
+        with f:
+            for line in f:
+                m = '{{' in line and self.embedder_re.match(line)
+                if m:
+                    embedded.append(self.input_path(m))
+                    for child_line in self.expand_lazily(embedded[-1], including + (path,)):
+                        yield child_line
+                else:
+                    yield line
+        include_graph.record(path, embedded)
+
+    def handleMatch(self, m):
+        return self.expand(self.input_path(m))[1]
+
+    def iter_lines(self, lines):
+        embedded = []
         for line in lines:
-            m = self.embedder_re.match(line)
+            m = '{{' in line and self.embedder_re.match(line)
             if m:
-                new_lines.extend(self.handleMatch(m))
+                embedded.append(self.input_path(m))
+                if self.stream:
+                    for embedded_line in self.expand_lazily(embedded[-1]):
+                        yield embedded_line
+                else:
+                    for embedded_line in self.handleMatch(m):
+                        yield embedded_line
             else:
-                new_lines.append(line)
+                yield line
+
+        page = getattr(_current, 'page', None)
+        if page is not None:
+            include_graph.record(page, embedded)
+
+    embedder_re = re.compile(r'{{(.*)}}')
+    def run(self, lines):
+        # most pages embed nothing; one substring search over the page is
+        # enough to hand them back untouched
+        if '{{' not in '\n'.join(lines):
+            page = getattr(_current, 'page', None)
+            if page is not None:
+                include_graph.record(page, ())
+            return lines
 
-        return new_lines
+        # in stream mode the embedded files are read as the next preprocessor
+        # consumes the generator. that one joins the lines back into a single
+        # string, so the whole expanded page is still held at once; stream
+        # only saves the list of expanded lines built here and the copies
+        # fragment_cache would keep
+        if self.stream:
+            return self.iter_lines(lines)
+        return list(self.iter_lines(lines))
 
 
 class ContentEmbedderExtension(markdown.Extension):
     def __init__(self, *args, **kwargs):
         self.docs_dir = kwargs.pop('docs_dir', 'docs')
+        self.stream = kwargs.pop('stream', False)
         super(ContentEmbedderExtension, self).__init__(*args, **kwargs)
 
     def extendMarkdown(self, md, md_globals):
-        inst = ContentEmbedderPattern(md, docs_dir=self.docs_dir)
+        inst = ContentEmbedderPattern(md, docs_dir=self.docs_dir, stream=self.stream)
         md.preprocessors.add('content_embedder', inst, '_begin')
         # md.postprocessors.add('content_embedder', inst, '_begin')
 
@@ -0,0 +1,574 @@
+from collections import OrderedDict
+from multiprocessing import Process, Queue
+import argparse
+import json
+import os
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.cElementTree as ET
+
+from desc import Fragment, PARAGRAPH
+from doxygen import DoxygenXMLConsumer
+from jsdoc import walk_docs as jsdoc_walk_docs
+from quiet import (build_text_block, gen_markdown_function, gen_markdown_c_struct,
+                   gen_markdown_java_class, gen_markdown_objc_interface, gen_markdown_js_object)
+from xmlbackend import available as available_xml_backends, known as known_xml_backends
+from templates import (compiled, c_enum_value_template, c_func_template, c_struct_member_template,
+                       c_struct_member_desc_template, func_parameter_template, func_return_template)
+
+
+# synthetic inputs. every compound gets the same mix of functions,
+# variables, enums, typedefs and properties, and every description nests
+# depth levels of markup over a depth line code listing, so the cost of
+# each phase scales with compounds, members and depth independently.
+
+
+def _desc_xml(index, compounds, depth):
+    ref = index % compounds
+    nested = '<emphasis>' * depth + 'nested {index}'.format(index=index) + '</emphasis> tail' * depth
+    code = ''.join('<codeline><highlight class="normal">int line{line} = <ref refid="compound{ref}">Compound{ref}</ref>;</highlight></codeline>'.format(line=line, ref=ref)
+                   for line in range(depth))
+    return (
+        '<para>Member {index} works with <computeroutput>value</computeroutput> and '
+        '<ref refid="compound{ref}" kindref="compound">Compound{ref}</ref><ndash/>see {nested}.'
+        '<parameterlist kind="param"><parameteritem><parameternamelist><parametername>arg</parametername>'
+        '</parameternamelist><parameterdescription><para>the argument</para></parameterdescription>'
+        '</parameteritem></parameterlist>'
+        '<parameterlist kind="exception"><parameteritem><parameternamelist><parametername>Failure</parametername>'
+        '</parameternamelist><parameterdescription><para>when it fails</para></parameterdescription>'
+        '</parameteritem></parameterlist>'
+        '<simplesect kind="return"><para>the result</para></simplesect>'
+        '<programlisting>{code}</programlisting></para>'
+        '<para>Second paragraph of {index}.</para>'
+    ).format(index=index, ref=ref, nested=nested, code=code)
+
+
+def _memberdef_xml(kind, index, compounds, depth):
+    name = 'member{index}'.format(index=index)
+    extra = ''
+    if kind == 'function':
+        # one selector fragment per argument, so objc can render it too
+        name += ':count:'
+        extra = ('<param><type>const <ref refid="compound{ref}">Compound{ref}</ref> *</type><declname>arg</declname></param>'
+                 '<param><type>int</type><declname>count</declname></param>'
+                 '<exceptions> throws <ref refid="compound{ref}">Compound{ref}</ref></exceptions>').format(ref=index % compounds)
+    elif kind == 'enum':
+        extra = ''.join('<enumvalue id="value{index}_{value}" prot="public"><name>VALUE_{index}_{value}</name>'
+                        '<initializer>= {value}</initializer><briefdescription><para>value {value}</para></briefdescription>'
+                        '<detaileddescription/></enumvalue>'.format(index=index, value=value)
+                        for value in range(4))
+    return (
+        '<memberdef kind="{kind}" id="member{index}" prot="public" static="no" const="no">'
+        '<type>int</type><name>{name}</name>{extra}'
+        '<briefdescription><para>Brief {index}.</para></briefdescription>'
+        '<detaileddescription>{desc}</detaileddescription></memberdef>'
+    ).format(kind=kind, index=index, name=name, extra=extra, desc=_desc_xml(index, compounds, depth))
+
+
+_member_kinds = ('function', 'variable', 'function', 'enum', 'typedef', 'property')
+
+
+def gen_doxygen_xml(path, compounds, members, depth, combined_path=None):
+    # writes a doxygen XML tree under path, and the same tree as one
+    # document, the way combine.xslt joins it, to combined_path; returns the
+    # number of members
+    index = ['<?xml version="1.0"?>', '<doxygenindex>']
+    compounddefs = []
+    for c in range(compounds):
+        index.append('<compound refid="compound{c}" kind="class"><name>bench::Compound{c}</name></compound>'.format(c=c))
+        memberdefs = []
+        for m in range(members):
+            kind = _member_kinds[m % len(_member_kinds)]
+            memberdefs.append(_memberdef_xml(kind, c * members + m, compounds, depth))
+        compounddef = (
+            '<compounddef id="compound{c}" kind="class" prot="public">'
+            '<compoundname>bench::Compound{c}</compoundname><basecompoundref>Base</basecompoundref>'
+            '<sectiondef kind="public-func">{memberdefs}</sectiondef>'
+            '<briefdescription><para>Compound {c}.</para></briefdescription>'
+            '<detaileddescription>{desc}</detaileddescription></compounddef>'
+        ).format(c=c, memberdefs='\n'.join(memberdefs), desc=_desc_xml(c, compounds, depth))
+        with open(os.path.join(path, 'compound{c}.xml'.format(c=c)), 'w') as f:
+            f.write('<?xml version="1.0"?>\n<doxygen>' + compounddef + '</doxygen>\n')
+        if combined_path:
+            compounddefs.append(compounddef)
+    index.append('</doxygenindex>')
+    with open(os.path.join(path, 'index.xml'), 'w') as f:
+        f.write('\n'.join(index))
+    if combined_path:
+        with open(combined_path, 'w') as f:
+            f.write('<?xml version="1.0"?>\n<doxygen>' + '\n'.join(compounddefs) + '</doxygen>\n')
+    return compounds * members
+
+
+def gen_nested_desc(nesting):
+    # one description nested nesting levels deep, each level with text, a
+    # sibling element and a tail; deep enough by default that a recursive
+    # walk would run out of stack
+    return ET.fromstring('<detaileddescription>' +
+                         '<para>level <computeroutput>code</computeroutput> <emphasis>' * nesting +
+                         'innermost' + '</emphasis> tail</para>' * nesting + '</detaileddescription>')
+
+
+def _jsdoc_description(index, depth):
+    return '\n\n'.join('Paragraph {p} of {index},\nwrapped.'.format(p=p, index=index) for p in range(depth + 1))
+
+
+def _jsdoc_function(index, depth):
+    return {
+        'name': 'function{index}'.format(index=index),
+        'description': _jsdoc_description(index, depth),
+        'parameters': [
+            {'name': 'options', 'description': 'the options', 'optional': False},
+            {'name': 'callback', 'description': 'called when done', 'optional': True},
+        ],
+        'returns': {'description': 'the result'},
+    }
+
+
+def gen_jsdoc_json(path, namespaces, members, depth):
+    # writes jsdoc haruki-style JSON to path; returns the number of members
+    docs = {'namespaces': []}
+    for n in range(namespaces):
+        functions = []
+        properties = []
+        for m in range(members):
+            index = n * members + m
+            if m % 2 == 0:
+                functions.append(_jsdoc_function(index, depth))
+            elif m % 3 == 0:
+                properties.append({'name': 'callback{index}'.format(index=index),
+                                   'type': 'callback{n}'.format(n=n),
+                                   'description': _jsdoc_description(index, depth)})
+            else:
+                properties.append({'name': 'property{index}'.format(index=index),
+                                   'type': 'number' if m % 5 else 'function',
+                                   'description': _jsdoc_description(index, depth)})
+        docs['namespaces'].append({
+            'name': 'Namespace{n}'.format(n=n),
+            'description': _jsdoc_description(n, depth),
+            'functions': functions,
+            'properties': properties,
+            'typedefs': [{
+                'name': 'callback{n}'.format(n=n),
+                'description': _jsdoc_description(n, depth),
+                'parameters': [{'name': 'err', 'description': 'the error', 'optional': False}],
+            }],
+        })
+    with open(path, 'w') as f:
+        json.dump(docs, f)
+    return namespaces * members
+
+
+def gen_jsdoc_fan_in_json(path, namespaces, members, depth):
+    # like gen_jsdoc_json, but every member is a property typed by one of a
+    # few shared callback typedefs, as with the event handlers of a real api
+    typedefs = []
+    for t in range(4):
+        typedef = _jsdoc_function(t, depth)
+        typedef['name'] = 'sharedCallback{t}'.format(t=t)
+        typedefs.append(typedef)
+    docs = {'namespaces': [{
+        'name': 'Callbacks',
+        'description': _jsdoc_description(0, depth),
+        'typedefs': typedefs,
+    }]}
+    for n in range(namespaces):
+        properties = []
+        for m in range(members):
+            index = n * members + m
+            properties.append({'name': 'on{index}'.format(index=index),
+                               'type': 'sharedCallback{t}'.format(t=index % len(typedefs)),
+                               'description': _jsdoc_description(index, depth)})
+        docs['namespaces'].append({
+            'name': 'Emitter{n}'.format(n=n),
+            'description': _jsdoc_description(n, depth),
+            'properties': properties,
+        })
+    with open(path, 'w') as f:
+        json.dump(docs, f)
+    return namespaces * members
+
+
+def _write_jsdoc_stub(bin_path):
+    # stands in for jsdoc on PATH, printing the synthetic JSON of the
+    # directory it is run in
+    stub = os.path.join(bin_path, 'jsdoc')
+    with open(stub, 'w') as f:
+        f.write('#!/bin/sh\nexec cat jsdoc.json\n')
+    os.chmod(stub, 0o755)
+
+
+# phases. each takes the fixture and returns the number of members it
+# processed, which the harness turns into members/s.
+
+
+def _descs(docs):
+    for struct in docs.itervalues():
+        yield struct['shortdesc']
+        yield struct['longdesc']
+        for func in struct['functions']:
+            yield func['brief_desc']
+            yield func['long_desc']
+        for section in ('members', 'enums', 'typedefs', 'properties'):
+            for item in struct[section].itervalues():
+                yield item['brief_desc']
+                yield item['long_desc']
+
+
+def _members(docs):
+    return sum(len(struct['functions']) + len(struct['members']) + len(struct['enums']) +
+               len(struct['typedefs']) + len(struct['properties'])
+               for struct in docs.itervalues())
+
+
+def phase_doxygen_parse(fixture):
+    DoxygenXMLConsumer(fixture['xml_path']).docs.load_all()
+    return fixture['doxygen_members']
+
+
+def _phase_doxygen_parse_with(backend):
+    def phase(fixture):
+        DoxygenXMLConsumer(fixture['xml_path'], backend=backend).docs.load_all()
+        return fixture['doxygen_members']
+    return phase
+
+
+def phase_doxygen_parse_combined(fixture):
+    DoxygenXMLConsumer(fixture['xml_path'], combined=fixture['combined_path']).docs.load_all()
+    return fixture['doxygen_members']
+
+
+def phase_desc_walk(fixture):
+    desc_from_element = fixture['doxygen_consumer']._desc_from_element
+    element = fixture['nested_desc']
+    for _ in range(_desc_walk_passes):
+        desc_from_element(element)
+    return _desc_walk_passes * fixture['nested_desc_nodes']
+
+
+_desc_walk_passes = 20
+
+
+# the recursive walk _desc_from_element used to be, kept to time the
+# current one against. it looks attribs up through the consumer, so only
+# the walks themselves differ, and it runs on a description shallow enough
+# for the recursion limit.
+def _recursive_desc_from_element(consumer, element, attribs=None):
+    if element is None:
+        return []
+    if element.tag in ('parameternamelist',):
+        return []
+    desc = []
+    parent_attribs = attribs
+    attrib = consumer._attrib_from_element(element)
+    if attrib:
+        attribs = consumer._merge_attribs(attribs, attrib)
+    if element.text is not None:
+        _append_desc(desc, element.text, attribs)
+    if attribs:
+        attribs = (attribs[0] & ~PARAGRAPH,) + attribs[1:]
+    for child in element:
+        desc.extend(_recursive_desc_from_element(consumer, child, attribs=attribs))
+    if element.tail is not None:
+        _append_desc(desc, element.tail, parent_attribs)
+    return desc
+
+
+def _append_desc(l, text, attrib):
+    if text.strip():
+        flags, ref, param = attrib or (0, None, None)
+        l.append(Fragment(text, flags, ref, param))
+
+
+def phase_desc_walk_shallow(fixture):
+    desc_from_element = fixture['doxygen_consumer']._desc_from_element
+    element = fixture['shallow_desc']
+    for _ in range(_desc_walk_passes):
+        desc_from_element(element)
+    return _desc_walk_passes * fixture['shallow_desc_nodes']
+
+
+def phase_desc_walk_recursive(fixture):
+    consumer = fixture['doxygen_consumer']
+    element = fixture['shallow_desc']
+    for _ in range(_desc_walk_passes):
+        _recursive_desc_from_element(consumer, element)
+    return _desc_walk_passes * fixture['shallow_desc_nodes']
+
+
+# nesting of the description both walks in the phases above take, within
+# reach of the default recursion limit
+_shallow_nesting = 150
+
+
+def phase_jsdoc_walk(fixture):
+    jsdoc_walk_docs(fixture['js_path'])
+    return fixture['jsdoc_members']
+
+
+def phase_jsdoc_walk_buffered(fixture):
+    jsdoc_walk_docs(fixture['js_path'], stream=False)
+    return fixture['jsdoc_members']
+
+
+def phase_jsdoc_fan_in(fixture):
+    jsdoc_walk_docs(fixture['js_fan_in_path'])
+    return fixture['jsdoc_fan_in_members']
+
+
+def phase_build_text_block(fixture):
+    for desc in _descs(fixture['doxygen_docs']):
+        build_text_block(desc)
+    return _members(fixture['doxygen_docs'])
+
+
+def _render(docs, render_compound, language):
+    for struct in docs.itervalues():
+        render_compound(struct)
+        for func in struct['functions']:
+            gen_markdown_function(func, language)
+    return _members(docs)
+
+
+def phase_render_c(fixture):
+    return _render(fixture['doxygen_docs'], gen_markdown_c_struct, 'c')
+
+
+def phase_render_java(fixture):
+    return _render(fixture['doxygen_docs'], gen_markdown_java_class, 'java')
+
+
+def phase_render_objc(fixture):
+    return _render(fixture['doxygen_docs'], gen_markdown_objc_interface, 'objc')
+
+
+def phase_render_js(fixture):
+    return _render(fixture['jsdoc_docs'], gen_markdown_js_object, 'js')
+
+
+# the templates a C member goes through, called with keyword arguments the
+# way the renderers call them, once through str.format and once compiled
+
+
+def phase_templates_format(fixture):
+    for index in xrange(fixture['doxygen_members']):
+        name = 'member{index}'.format(index=index)
+        c_func_template.format(function_name=name, return_type='int', argstring='int arg', description='Description.')
+        func_parameter_template.format(name='arg', desc='the argument')
+        func_return_template.format(returns='the result')
+        c_struct_member_template.format(indent='    ', type='int', name=name)
+        c_struct_member_desc_template.format(name=name, description='Description.')
+        c_enum_value_template.format(indent='    ', value_name=name, initializer=' = 1')
+    return fixture['doxygen_members']
+
+
+def phase_templates_compiled(fixture):
+    for index in xrange(fixture['doxygen_members']):
+        name = 'member{index}'.format(index=index)
+        compiled.c_func(function_name=name, return_type='int', argstring='int arg', description='Description.')
+        compiled.func_parameter(name='arg', desc='the argument')
+        compiled.func_return(returns='the result')
+        compiled.c_struct_member(indent='    ', type='int', name=name)
+        compiled.c_struct_member_desc(name=name, description='Description.')
+        compiled.c_enum_value(indent='    ', value_name=name, initializer=' = 1')
+    return fixture['doxygen_members']
+
+
+phases = OrderedDict((
+    ('doxygen.parse', phase_doxygen_parse),
+    ('doxygen.parse.combined', phase_doxygen_parse_combined),
+    ('doxygen.desc_walk', phase_desc_walk),
+    ('doxygen.desc_walk.shallow', phase_desc_walk_shallow),
+    ('doxygen.desc_walk.recursive', phase_desc_walk_recursive),
+))
+# the parse again on each XML backend installed, default first
+phases.update(('doxygen.parse.' + backend, _phase_doxygen_parse_with(backend))
+              for backend in available_xml_backends())
+phases.update((
+    ('jsdoc.walk_docs', phase_jsdoc_walk),
+    ('jsdoc.buffered', phase_jsdoc_walk_buffered),
+    ('jsdoc.fan_in', phase_jsdoc_fan_in),
+    ('build_text_block', phase_build_text_block),
+    ('render.c', phase_render_c),
+    ('render.java', phase_render_java),
+    ('render.objc', phase_render_objc),
+    ('render.js', phase_render_js),
+    ('templates.format', phase_templates_format),
+    ('templates.compiled', phase_templates_compiled),
+))
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return 0
+
+
+def _run_phase(phase, fixture, results):
+    # runs in a forked child so that each phase's peak memory is its own
+    start_rss = _rss()
+    start = time.time()
+    count = phase(fixture)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start_rss
+    results.put((count, seconds, max(peak, 0)))
+
+
+def measure(phase, fixture, repeat):
+    best = None
+    for _ in range(repeat):
+        results = Queue()
+        p = Process(target=_run_phase, args=(phase, fixture, results))
+        p.start()
+        p.join()
+        if p.exitcode:
+            raise Exception('benchmark phase exited with {code}'.format(code=p.exitcode))
+        count, seconds, peak = results.get()
+        if best is None or seconds < best[1]:
+            best = (count, seconds, peak)
+    count, seconds, peak = best
+    return {
+        'members': count,
+        'seconds': seconds,
+        'members_per_second': count / seconds if seconds else float('inf'),
+        'peak_mb': peak / (1024.0 * 1024.0),
+    }
+
+
+def make_fixture(work_path, compounds, members, depth, nesting):
+    xml_path = os.path.join(work_path, 'xml') + os.sep
+    js_path = os.path.join(work_path, 'js')
+    js_fan_in_path = os.path.join(work_path, 'js-fan-in')
+    bin_path = os.path.join(work_path, 'bin')
+    for path in (xml_path, js_path, js_fan_in_path, bin_path):
+        os.makedirs(path)
+    combined_path = os.path.join(work_path, 'all.xml')
+    fixture = {
+        'xml_path': xml_path,
+        'combined_path': combined_path,
+        'js_path': js_path,
+        'js_fan_in_path': js_fan_in_path,
+        'doxygen_members': gen_doxygen_xml(xml_path, compounds, members, depth, combined_path=combined_path),
+        'jsdoc_members': gen_jsdoc_json(os.path.join(js_path, 'jsdoc.json'), compounds, members, depth),
+        'jsdoc_fan_in_members': gen_jsdoc_fan_in_json(os.path.join(js_fan_in_path, 'jsdoc.json'),
+                                                      compounds, members, depth),
+    }
+    _write_jsdoc_stub(bin_path)
+    os.environ['PATH'] = bin_path + os.pathsep + os.environ.get('PATH', '')
+    consumer = DoxygenXMLConsumer(xml_path)
+    fixture['doxygen_consumer'] = consumer
+    fixture['doxygen_docs'] = consumer.docs.load_all()
+    fixture['nested_desc'] = gen_nested_desc(nesting)
+    fixture['nested_desc_nodes'] = 1 + 3 * nesting
+    fixture['shallow_desc'] = gen_nested_desc(_shallow_nesting)
+    fixture['shallow_desc_nodes'] = 1 + 3 * _shallow_nesting
+    fixture['jsdoc_docs'] = jsdoc_walk_docs(js_path)
+    return fixture
+
+
+def check_xml_backends(fixture):
+    # returns the XML backends, and ingestion modes of each, whose docs
+    # differ from the default per-file parse of the synthetic XML
+    mismatched = []
+    for backend in available_xml_backends():
+        if DoxygenXMLConsumer(fixture['xml_path'], backend=backend).docs.load_all() != fixture['doxygen_docs']:
+            mismatched.append(backend)
+        if DoxygenXMLConsumer(fixture['xml_path'], backend=backend,
+                              combined=fixture['combined_path']).docs.load_all() != fixture['doxygen_docs']:
+            mismatched.append(backend + ' (combined)')
+    return mismatched
+
+
+def compare(results, baseline, tolerance):
+    # returns the phases whose throughput fell more than tolerance below
+    # the baseline
+    regressions = []
+    for name, result in results.iteritems():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['members_per_second']
+        if result['members_per_second'] < expected * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def print_table(results, baseline=None):
+    header = '{name:<28} {members:>8} {seconds:>9} {rate:>12} {peak:>9}'
+    row = '{name:<28} {members:>8} {seconds:>9.3f} {rate:>12.0f} {peak:>9.1f}'
+    line = header.format(name='phase', members='members', seconds='seconds', rate='members/s', peak='peak MB')
+    if baseline:
+        line += ' {change:>9}'.format(change='vs base')
+    print(line)
+    for name, result in results.iteritems():
+        line = row.format(name=name, members=result['members'], seconds=result['seconds'],
+                          rate=result['members_per_second'], peak=result['peak_mb'])
+        if baseline and name in baseline:
+            change = result['members_per_second'] / baseline[name]['members_per_second'] - 1
+            line += ' {change:>+8.1%}'.format(change=change)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the doxydown extract and render pipeline on synthetic input.')
+    parser.add_argument('--compounds', type=int, default=50, help='compounds (and jsdoc namespaces) to generate')
+    parser.add_argument('--members', type=int, default=40, help='members per compound')
+    parser.add_argument('--depth', type=int, default=3, help='markup nesting and code listing length of each description')
+    parser.add_argument('--nesting', type=int, default=2000,
+                        help='nesting depth of the description walked by the doxygen.desc_walk phase')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per phase; the fastest is reported')
+    parser.add_argument('--phase', action='append', choices=phases.keys(), help='only run this phase; may be repeated')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against results saved with --save-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed throughput drop against the baseline before failing (default 0.1)')
+    parser.add_argument('--skip-xml-backend-check', action='store_true',
+                        help='do not check that every installed XML backend, per file and combined, '
+                             'parses the synthetic XML alike')
+    args = parser.parse_args(argv)
+
+    work_path = tempfile.mkdtemp(prefix='doxydown-bench-')
+    try:
+        fixture = make_fixture(work_path, args.compounds, args.members, args.depth, args.nesting)
+        mismatched = []
+        if not args.skip_xml_backend_check:
+            mismatched = check_xml_backends(fixture)
+            missing = [name for name in known_xml_backends() if name not in available_xml_backends()]
+            if missing:
+                # a backend that is not installed is not checked, and would
+                # otherwise pass unnoticed
+                sys.stderr.write('*** WARNING: XML backends not installed, so NOT checked: ' +
+                                 ', '.join(missing) + ' ***\n')
+        results = OrderedDict()
+        for name in args.phase or phases.keys():
+            results[name] = measure(phases[name], fixture, args.repeat)
+    finally:
+        shutil.rmtree(work_path)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    if mismatched:
+        print('XML backends differing from the default: ' + ', '.join(mismatched))
+        return 1
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('regressed: ' + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
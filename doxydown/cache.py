@@ -0,0 +1,136 @@
+from collections import Mapping
+import hashlib
+import os
+import os.path
+import shutil
+
+import ir
+
+
+def digest_paths(root, paths, extensions=None, exclude=()):
+    # hashes file names and contents below root, walking directories in
+    # sorted order so the digest only changes when an input does
+    h = hashlib.sha1()
+    for path in paths:
+        full_path = os.path.join(root, path)
+        if os.path.isfile(full_path):
+            _digest_file(h, root, full_path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(full_path):
+            dirnames[:] = sorted(d for d in dirnames
+                                 if not d.startswith('.') and
+                                 os.path.relpath(os.path.join(dirpath, d), root) not in exclude)
+            for filename in sorted(filenames):
+                if extensions and os.path.splitext(filename)[1] not in extensions:
+                    continue
+                _digest_file(h, root, os.path.join(dirpath, filename))
+
+    return h.hexdigest()
+
+
+def _digest_file(h, root, path):
+    h.update(os.path.relpath(path, root))
+    h.update('\0')
+    with open(path, 'rb') as f:
+        h.update(f.read())
+    h.update('\0')
+
+
+class CachedMapping(Mapping):
+    # a mapping read back from a cache entry one value at a time. values the
+    # entry lacks come from the mapping build() returns, which is only called
+    # once one is needed, and are written to the entry as they are looked up,
+    # so an entry ends up holding what its readers used.
+    def __init__(self, entry_path, keys, build, mapping=None):
+        self._entry_path = entry_path
+        self._keys = keys
+        self._key_set = frozenset(keys)
+        self._build = build
+        self._mapping = mapping
+        self._values = {}
+
+    def _value_path(self, key):
+        return os.path.join(self._entry_path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.ir')
+
+    def __getitem__(self, key):
+        value = self._values.get(key)
+        if value is not None:
+            return value
+        if key not in self._key_set:
+            raise KeyError(key)
+        value = ir.load(self._value_path(key))
+        if value is None:
+            if self._mapping is None:
+                self._mapping = self._build()
+            value = self._mapping[key]
+            ir.dump(value, self._value_path(key))
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._key_set
+
+
+class BuildCache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, name, digest, ext='.ir'):
+        return os.path.join(self.cache_dir, '{name}-{digest}{ext}'.format(name=name, digest=digest, ext=ext))
+
+    def _clear(self, name, digest):
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                pass
+        # only the latest entry per name is kept, be it a file or a
+        # directory; the length check keeps names sharing a prefix (say
+        # 'quiet' and 'quiet-js') apart
+        prefix = name + '-'
+        entry = os.path.basename(self._path(name, digest, ext=''))
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(prefix) and len(os.path.splitext(filename)[0]) == len(entry):
+                path = os.path.join(self.cache_dir, filename)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def load(self, name, digest):
+        return ir.load(self._path(name, digest))
+
+    def store(self, name, digest, docs):
+        self._clear(name, digest)
+        ir.dump(docs, self._path(name, digest))
+
+    def get(self, name, digest, build):
+        docs = self.load(name, digest)
+        if docs is None:
+            docs = build()
+            self.store(name, digest, docs)
+        return docs
+
+    def get_mapping(self, name, digest, build):
+        # like get(), but for a mapping whose values are costly to make one
+        # by one: the entry is a directory with the keys and a file per value
+        # looked up, read back as a CachedMapping. build() is called up front
+        # on a miss, and otherwise only once a value the entry lacks is
+        # looked up.
+        entry_path = self._path(name, digest, ext='')
+        keys_path = os.path.join(entry_path, 'keys.ir')
+        keys = ir.load(keys_path)
+        if keys is not None:
+            return CachedMapping(entry_path, keys, build)
+        mapping = build()
+        self._clear(name, digest)
+        os.makedirs(entry_path)
+        keys = list(mapping)
+        ir.dump(keys, keys_path)
+        return CachedMapping(entry_path, keys, build, mapping)
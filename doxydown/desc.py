@@ -0,0 +1,45 @@
+from collections import namedtuple
+
+
+# markup flags carried by a description fragment, OR'd together into
+# Fragment.flags
+RETURN = 1 << 0
+NOTE = 1 << 1
+WARNING = 1 << 2
+FIXED = 1 << 3
+EMPHASIS = 1 << 4
+NDASH = 1 << 5
+PARAGRAPH = 1 << 6
+EXAMPLE = 1 << 7
+INFO = 1 << 8
+EXCEPTION = 1 << 9
+LINKABLE = 1 << 10
+
+
+_strings = {}
+
+
+def intern_string(s):
+    # refs and param names repeat across the whole docs tree, so every
+    # fragment shares one copy of each. unlike intern() this also takes
+    # the unicode strings that come out of the XML and JSON parsers.
+    if s is None:
+        return None
+    return _strings.setdefault(s, s)
+
+
+class Fragment(namedtuple('Fragment', ('text', 'flags', 'ref', 'param'))):
+    # a run of description text along with the markup it appeared in.
+    # ref is the symbol the text refers to, param the parameter, exception
+    # or other name it documents; both are None when not applicable.
+    # callers pass ref and param through intern_string.
+    __slots__ = ()
+
+
+Fragment.__new__.__defaults__ = (0, None, None)
+
+
+def make_fragment(text, attribs):
+    # builds a Fragment from text and a (flags, ref, param) tuple without
+    # going through the namedtuple constructor, for the parsers' hot loops
+    return tuple.__new__(Fragment, (text,) + attribs)
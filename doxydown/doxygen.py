@@ -1,136 +1,254 @@
-import xml.etree.ElementTree as ET
-from collections import OrderedDict
+from collections import Mapping, OrderedDict
+import multiprocessing
 import os.path
 import subprocess
 
+from desc import *
+import tracing
+from xmlbackend import get_backend
+
+
+_no_attrib = (0, None, None)
+
+
+# description elements that only add markup flags
+_flag_attribs = {
+    'computeroutput': (FIXED, None, None),
+    'emphasis': (EMPHASIS, None, None),
+    'ndash': (NDASH, None, None),
+    'para': (PARAGRAPH, None, None),
+    'programlisting': (EXAMPLE, None, None),
+    'highlight': (INFO, None, None),
+}
+
+
+_simplesect_attribs = {
+    'return': (RETURN, None, None),
+    'note': (NOTE, None, None),
+    'warning': (WARNING, None, None),
+}
+
+
+# description elements that add no markup of their own
+_plain_elements = frozenset((
+    'type',
+    'briefdescription',
+    'detaileddescription',
+    'parameterlist',
+    'parameternamelist',
+    'parametername',
+    'parameterdescription',
+    'codeline',
+    'exceptions',
+))
+
+
+# the children of a compounddef that _struct_from_element reads; the
+# backends drop the others as they are parsed
+_compound_children = frozenset(('compoundname', 'basecompoundref', 'briefdescription', 'detaileddescription'))
+
+
+def _parse_compounds_worker(args):
+    # parses a chunk of compounds in a pool worker. the ref tables built
+    # from index.xml in the parent travel with each chunk, so one pool can
+    # serve every consumer.
+    backend, inverted_refs, paths = args
+    consumer = DoxygenXMLConsumer._parser(backend, inverted_refs)
+    return [consumer._parse_compound(path) for path in paths]
+
+
+def _new_sections():
+    return {
+        'functions': [],
+        'members': OrderedDict(),
+        'enums': OrderedDict(),
+        'typedefs': OrderedDict(),
+        'properties': OrderedDict(),
+    }
+
+
+def _relink(descs, inverted_refs):
+    # fragments built before the ref tables were complete carry the refid
+    # of the compound they refer to instead of its name; gives them the name
+    # and the link flag they would have had with the tables known up front
+    for desc in descs:
+        for index, fragment in enumerate(desc):
+            if fragment.ref in inverted_refs and not fragment.flags & LINKABLE:
+                desc[index] = make_fragment(fragment.text, (fragment.flags | LINKABLE, inverted_refs[fragment.ref],
+                                                            fragment.param))
+
+
+class LazyDocs(Mapping):
+    # compound name -> struct. the ref tables come from index.xml up front,
+    # but a compound's own XML is only parsed the first time it is looked
+    # up, so renderers that use a handful of compounds skip the rest.
+    def __init__(self, consumer, paths, structs=None):
+        self._consumer = consumer
+        self._paths = paths
+        self._structs = structs or {}
+
+    def __getitem__(self, name):
+        struct = self._structs.get(name)
+        if struct is None:
+            struct = self._structs[name] = self._consumer._parse_compound(self._paths[name])
+        return struct
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def load_all(self):
+        # parses every compound not looked up yet, across the consumer's
+        # workers if it has them, and returns all of them as a plain dict
+        names = [name for name in self._paths if name not in self._structs]
+        parsed = self._consumer._parse_compounds([self._paths[name] for name in names])
+        self._structs.update(zip(names, parsed))
+        return dict(self._structs)
+
 
 class DoxygenXMLConsumer(object):
-    def __init__(self, base_path, gen_docs=None):
+    def __init__(self, base_path, gen_docs=None, workers=None, backend=None, combined=None, pool=None):
+        # compounds parsed all at once are spread over workers processes,
+        # from pool when one is given and from a pool of their own otherwise
+        self._backend = get_backend(backend)
         if gen_docs:
-            subprocess.call(('doxygen', 'Doxyfile'), cwd=gen_docs)
-        self._refs, self._filenames = self._find_symbols(os.path.join(base_path, 'index.xml'))
+            with tracing.span('doxygen', gen_docs):
+                subprocess.call(('doxygen', 'Doxyfile'), cwd=gen_docs)
+        self._workers = workers
+        self._pool = pool
+        # descriptions holding refs that were not in the ref tables yet, kept
+        # while reading a combined document
+        self._forward_descs = None
+        self._forward_ref = False
+        if combined:
+            self.docs = self._read_combined(os.path.join(base_path, combined))
+            return
+        self._refs, self._compounds = self._find_symbols(os.path.join(base_path, 'index.xml'))
         self._inverted_refs = {v: k for k, v in self._refs.iteritems()}
         self.docs = self._walk_docs(base_path)
 
+    @classmethod
+    def _parser(cls, backend, inverted_refs):
+        # a consumer that only parses compounds, against ref tables that
+        # were read elsewhere
+        consumer = cls.__new__(cls)
+        consumer._backend = get_backend(backend)
+        consumer._inverted_refs = inverted_refs
+        consumer._forward_descs = None
+        consumer._forward_ref = False
+        return consumer
+
     def _find_symbols(self, path):
-        index_tree = ET.parse(path)
-        index_root = index_tree.getroot()
-        filenames = []
+        index_root = self._backend.parse(path)
+        compounds = []
         refs = {}
         for c in index_root.iterfind('compound'):
             name = c.find('name')
             ref = c.attrib.get('refid', None)
             if name is not None and ref:
-                filenames.append(ref)
+                compounds.append((name.text, ref))
                 refs[name.text] = ref
 
-        return refs, filenames
+        return refs, compounds
 
 
-    def _append_desc(self, l, text, attrib):
-        if text.strip():
-            d = dict(attrib or {})
-            d['text'] = text
-            l.append(d)
+    # attribs are (flags, ref, param) tuples. an element's attrib adds its
+    # flags to the enclosing ones, and its ref or param replace theirs.
+    def _merge_attribs(self, attribs, attrib):
+        flags, ref, param = attribs or _no_attrib
+        element_flags, element_ref, element_param = attrib
+        if element_ref is not None:
+            flags &= ~LINKABLE
+            ref = element_ref
+        if element_param is not None:
+            param = element_param
+        return flags | element_flags, ref, param
 
 
     def _attrib_from_element(self, element):
-        if element.tag == 'ref':
+        tag = element.tag
+        attrib = _flag_attribs.get(tag)
+        if attrib is not None:
+            return attrib
+        if tag == 'ref':
             refid = element.attrib.get('refid')
             if refid in self._inverted_refs:
-                return {
-                    'ref': self._inverted_refs[refid],
-                    'linkable': True,
-                }
-            return {
-                'ref': refid,
-                'linkable': False,
-            }
-        if element.tag == 'simplesect':
+                return LINKABLE, self._inverted_refs[refid], None
+            self._forward_ref = True
+            return 0, intern_string(refid), None
+        if tag == 'simplesect':
             sect_type = element.attrib.get('kind')
-            if sect_type == 'return':
-                return {
-                    'return': True,
-                }
-            if sect_type == 'note':
-                return {
-                    'note': True,
-                }
-            if sect_type == 'warning':
-                return {
-                    'warning': True,
-                }
+            if sect_type in _simplesect_attribs:
+                return _simplesect_attribs[sect_type]
             raise Exception('unrecognized simplesect kind ' + sect_type)
-        if element.tag == 'computeroutput':
-            return {
-                'fixed': True,
-            }
-        if element.tag == 'emphasis':
-            return {
-                'emphasis': True,
-            }
-        if element.tag == 'ndash':
-            return {
-                'ndash': True,
-            }
-        if element.tag == 'para':
-            return {
-                'paragraph': True,
-            }
-        if element.tag == 'programlisting':
-            return {
-                'example': True,
-            }
-        if element.tag == 'highlight':
-            return {
-                'info': True,
-            }
-        if element.tag == 'parameterlist' and element.attrib.get('kind') == 'exception':
-            return {
-                'exception': True,
-            }
-        if element.tag in ('type',
-                           'briefdescription',
-                           'detaileddescription',
-                           'parameterlist',
-                           'parameternamelist',
-                           'parametername',
-                           'parameterdescription',
-                           'codeline',
-                           'exceptions',):
+        if tag == 'parameterlist' and element.attrib.get('kind') == 'exception':
+            return EXCEPTION, None, None
+        if tag in _plain_elements:
             return None
-        if element.tag == 'parameteritem':
+        if tag == 'parameteritem':
             params = []
             for p in element.find('parameternamelist').iterfind('parametername'):
                 params.append(p.text)
             if len(params) > 1:
                 raise Exception('doc referencing more than one param found')
-            return {
-                'param': params[0],
-            }
-        raise Exception('unrecognized desc element ' + element.tag)
+            return 0, None, intern_string(params[0])
+        raise Exception('unrecognized desc element ' + tag)
 
 
     def _desc_from_element(self, element, attribs=None):
-        if element is None:
-            return []
-        if element.tag in ('parameternamelist',):
-            return []
         desc = []
-        parent_attribs = attribs
-        attrib = self._attrib_from_element(element)
-        if attrib:
-            attribs = dict(attribs or {})
-            attribs.update(attrib)
-        if element.text is not None:
-            self._append_desc(desc, element.text, attribs)
-        if attribs:
-            attribs.pop('paragraph', None)
-        for child in element:
-            desc.extend(self._desc_from_element(child, attribs=attribs))
-        if element.tail is not None:
-            self._append_desc(desc, element.tail, parent_attribs)
-        return desc
+        if element is None:
+            return desc
+        if tracing.enabled:
+            tracing.count('description nodes', sum(1 for _ in element.iter()))
+        append = desc.append
+        attrib_from_element = self._attrib_from_element
+        merge_attribs = self._merge_attribs
+        # walks the tree with an explicit stack rather than recursion, so
+        # every fragment lands directly in desc. the current level is the
+        # parent element, the attribs for its tail, an iterator over its
+        # remaining children and the attribs those children inherit; the
+        # stack holds the levels above it.
+        stack = []
+        parent, parent_attribs = None, None
+        children, child_attribs = iter((element,)), attribs or _no_attrib
+        self._forward_ref = False
+        while True:
+            for child in children:
+                if child.tag == 'parameternamelist':
+                    continue
+                attrib = attrib_from_element(child)
+                own_attribs = child_attribs
+                if attrib:
+                    own_attribs = merge_attribs(child_attribs, attrib)
+                text = child.text
+                if text is not None and text.strip():
+                    append(make_fragment(text, own_attribs))
+                if len(child):
+                    if own_attribs[0] & PARAGRAPH:
+                        own_attribs = (own_attribs[0] & ~PARAGRAPH,) + own_attribs[1:]
+                    stack.append((parent, parent_attribs, children, child_attribs))
+                    parent, parent_attribs = child, child_attribs
+                    children, child_attribs = iter(child), own_attribs
+                    break
+                text = child.tail
+                if text is not None and text.strip():
+                    append(make_fragment(text, child_attribs))
+            else:
+                if parent is not None:
+                    text = parent.tail
+                    if text is not None and text.strip():
+                        append(make_fragment(text, parent_attribs))
+                if not stack:
+                    if self._forward_ref and self._forward_descs is not None:
+                        self._forward_descs.append(desc)
+                    return desc
+                parent, parent_attribs, children, child_attribs = stack.pop()
 
 
     def _bool_from_yesno(self, yesno):
@@ -212,58 +330,128 @@ class DoxygenXMLConsumer(object):
         }
 
 
+    def _add_memberdef(self, sections, m):
+        if m.attrib.get('prot') not in ('public', 'protected'):
+            if m.attrib.get('prot') not in ('private', 'package'):
+                raise Exception('unrecognized prot ' + m.attrib.get('prot'))
+            return
+        kind = m.attrib.get('kind', None)
+        if kind == 'variable':
+            member = self._member_from_element(m)
+            sections['members'][member['name']] = member
+        elif kind == 'function':
+            func = self._func_from_element(m)
+            sections['functions'].append(func)
+        elif kind == 'enum':
+            enum = self._enum_from_element(m)
+            sections['enums'][enum['name']] = enum
+        elif kind == 'typedef':
+            typedef = self._typedef_from_element(m)
+            sections['typedefs'][typedef['name']] = typedef
+        elif kind == 'property':
+            prop = self._property_from_element(m)
+            sections['properties'][prop['name']] = prop
+        else:
+            raise Exception('unrecognized kind ' + kind)
+
+
+    def _struct_from_element(self, compounddef, sections):
+        name = compounddef.find('compoundname').text.split(':')[-1]
+        base = compounddef.find('basecompoundref')
+        return {
+            'name': name,
+            'kind': compounddef.attrib.get('kind'),
+            'shortdesc': self._desc_from_element(compounddef.find('briefdescription')),
+            'longdesc': self._desc_from_element(compounddef.find('detaileddescription')),
+            'functions': sections['functions'],
+            'members': sections['members'],
+            'enums': sections['enums'],
+            'typedefs': sections['typedefs'],
+            'properties': sections['properties'],
+            'protection': compounddef.attrib.get('prot'),
+            'base': base.text if base is not None else None,
+        }
+
+
+    def _parse_compound(self, path):
+        sections = _new_sections()
+        with tracing.span('parse', os.path.basename(path)):
+            with open(path, 'rb') as source:
+                for element in self._backend.iter_compounds(source, _compound_children):
+                    if element.tag == 'memberdef':
+                        self._add_memberdef(sections, element)
+                    else:
+                        return self._struct_from_element(element, sections)
+
+        raise Exception('no compounddef found in ' + path)
+
+
+    def _parse_compounds(self, paths):
+        if not self._workers or self._workers < 2 or len(paths) < 2:
+            return [self._parse_compound(path) for path in paths]
+        pool = self._pool or multiprocessing.Pool(min(self._workers, len(paths)))
+        try:
+            # map hands results back in input order, so merging them below
+            # matches the serial walk exactly
+            size = max(1, len(paths) // (self._workers * 4))
+            chunks = [(self._backend.name, self._inverted_refs, paths[i:i + size])
+                      for i in range(0, len(paths), size)]
+            parsed = pool.map(_parse_compounds_worker, chunks)
+            if pool is not self._pool:
+                pool.close()
+        except:
+            if pool is not self._pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not self._pool:
+                pool.join()
+        return [struct for structs in parsed for struct in structs]
+
+
     def _walk_docs(self, base_path):
+        # docs are keyed by the last component of each compound's name, as
+        # _struct_from_element names them; when two compounds share it, the
+        # one listed last in the index wins
+        paths = {}
+        for name, ref in self._compounds:
+            paths[name.split(':')[-1]] = base_path + ref + '.xml'
+        return LazyDocs(self, paths)
+
+
+    def _read_combined(self, path):
+        # the whole tree as one document, as doxygen's combine.xslt writes it
+        # (xsltproc combine.xslt index.xml > all.xml), read in a single pass
+        # instead of index.xml and a file per compound. the ref tables are
+        # built from each compounddef as it ends, in the order the index
+        # lists them, but only complete once all of the document has been
+        # read: a name shared by two compounds belongs to the last one. so
+        # every ref is kept as a raw refid during the pass, and put right
+        # against the final tables at the end.
+        self._refs = {}
+        self._compounds = []
+        self._inverted_refs = {}
+        self._forward_descs = []
+        paths = {}
         structs = {}
-        for f in self._filenames:
-            path = base_path + f + '.xml'
-            t = ET.parse(path)
-            r = t.getroot()
-            compounddef = r.find('compounddef')
-            functions = []
-            members = OrderedDict()
-            enums = OrderedDict()
-            typedefs = OrderedDict()
-            properties = OrderedDict()
-
-            for sectiondef in compounddef.iterfind('sectiondef'):
-                for m in sectiondef.iterfind('memberdef'):
-                    if m.attrib.get('prot') not in ('public', 'protected'):
-                        if m.attrib.get('prot') not in ('private', 'package'):
-                            raise Exception('unrecognized prot ' + m.attrib.get('prot'))
+        sections = _new_sections()
+        with tracing.span('parse', os.path.basename(path)):
+            with open(path, 'rb') as source:
+                for element in self._backend.iter_compounds(source, _compound_children):
+                    if element.tag == 'memberdef':
+                        self._add_memberdef(sections, element)
                         continue
-                    kind = m.attrib.get('kind', None)
-                    if kind == 'variable':
-                        member = self._member_from_element(m)
-                        members[member['name']] = member
-                    elif kind == 'function':
-                        func = self._func_from_element(m)
-                        functions.append(func)
-                    elif kind == 'enum':
-                        enum = self._enum_from_element(m)
-                        enums[enum['name']] = enum
-                    elif kind == 'typedef':
-                        typedef = self._typedef_from_element(m)
-                        typedefs[typedef['name']] = typedef
-                    elif kind == 'property':
-                        prop = self._property_from_element(m)
-                        properties[prop['name']] = prop
-                    else:
-                        raise Exception('unrecognized kind ' + kind)
-
-            name = compounddef.find('compoundname').text.split(':')[-1]
-            base = compounddef.find('basecompoundref')
-            structs[name] = {
-                'name': name,
-                'kind': compounddef.attrib.get('kind'),
-                'shortdesc': self._desc_from_element(compounddef.find('briefdescription')),
-                'longdesc': self._desc_from_element(compounddef.find('detaileddescription')),
-                'functions': functions,
-                'members': members,
-                'enums': enums,
-                'typedefs': typedefs,
-                'properties': properties,
-                'protection': compounddef.attrib.get('prot'),
-                'base': base.text if base is not None else None,
-            }
-
-        return structs
+                    name = element.find('compoundname').text
+                    ref = element.attrib.get('id')
+                    struct = self._struct_from_element(element, sections)
+                    sections = _new_sections()
+                    if name is None or not ref:
+                        continue
+                    self._compounds.append((name, ref))
+                    self._refs[name] = ref
+                    paths[name.split(':')[-1]] = path
+                    structs[name.split(':')[-1]] = struct
+        self._inverted_refs = {v: k for k, v in self._refs.iteritems()}
+        _relink(self._forward_descs, self._inverted_refs)
+        self._forward_descs = None
+        return LazyDocs(self, paths, structs)
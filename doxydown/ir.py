@@ -0,0 +1,55 @@
+from collections import Mapping, OrderedDict
+import marshal
+
+from desc import Fragment
+from pages import write_atomically
+
+
+# bump whenever the shape of the docs structure or its encoding changes,
+# so that stale files are ignored rather than misread
+IR_VERSION = 2
+IR_HEADER = 'doxydown-ir {version}\n'.format(version=IR_VERSION)
+
+
+# the parsed docs are nested dicts, OrderedDicts, lists, Fragments, strings,
+# ints, bools and None. marshal only takes the builtin types, so fragments
+# are stored as plain (text, flags, ref, param) tuples and OrderedDicts as
+# (None, items) pairs, told apart by the first slot as text is never None.
+# other mappings, such as lazily parsed docs, are stored as dicts.
+def _encode(obj):
+    if isinstance(obj, Fragment):
+        return tuple(obj)
+    if isinstance(obj, OrderedDict):
+        return (None, tuple((k, _encode(v)) for k, v in obj.iteritems()))
+    if isinstance(obj, Mapping):
+        return {k: _encode(v) for k, v in obj.iteritems()}
+    if isinstance(obj, list):
+        return [_encode(v) for v in obj]
+    return obj
+
+
+def _decode(obj):
+    if isinstance(obj, tuple):
+        if obj[0] is None:
+            return OrderedDict((k, _decode(v)) for k, v in obj[1])
+        return Fragment(*obj)
+    if isinstance(obj, dict):
+        return {k: _decode(v) for k, v in obj.iteritems()}
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    return obj
+
+
+def dump(docs, path):
+    write_atomically(path, IR_HEADER + marshal.dumps(_encode(docs)), prefix='.ir-')
+
+
+def load(path):
+    # returns None when path is missing or was written by another version
+    try:
+        with open(path, 'rb') as f:
+            if f.readline() != IR_HEADER:
+                return None
+            return _decode(marshal.load(f))
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
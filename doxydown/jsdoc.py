@@ -1,61 +1,56 @@
 import os.path
+import re
 import subprocess
-import pprint
+import sys
 import json
 from collections import OrderedDict
 
+from desc import Fragment, PARAGRAPH, RETURN, intern_string
+import tracing
 
-def find_typedefs(root, prefix):
-    if not isinstance(root, list) and not isinstance(root, dict):
-        return [], {}
-    paths = []
-    refs = {}
-    if root.get('typedefs'):
-        for index, typedef in enumerate(root['typedefs']):
-            path = prefix + ('typedefs', index)
-            paths.append(path)
-            refs[typedef['name']] = path
-
-    for k, v in root.iteritems():
-        if isinstance(v, list):
-            for index, item in enumerate(v):
-                next_prefix = prefix + (k, index)
-                found_paths, found_refs = find_typedefs(item, next_prefix)
-                paths.extend(found_paths)
-                refs.update(found_refs)
+
+def find_typedefs(root):
+    # every typedef anywhere in the jsdoc output, in depth first order. the
+    # walk keeps its own stack of the containers still to visit, so each
+    # object is looked at once however deeply it is nested.
+    typedefs = []
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if obj.get('typedefs'):
+                typedefs.extend(obj['typedefs'])
+            children = obj.values()
         else:
-            next_prefix = prefix + (k,)
-            found_paths, found_refs = find_typedefs(v, next_prefix)
-            paths.extend(found_paths)
-            refs.update(found_refs)
+            children = obj
+        for child in reversed(children):
+            if isinstance(child, (dict, list)):
+                stack.append(child)
 
-    return paths, refs
+    return typedefs
 
 
 def find_symbols(docs):
-    paths = []
+    # the namespaces and typedefs, as the objects themselves and a name ->
+    # object table; later symbols win on a name clash
+    symbols = list(docs.get('namespaces', []))
+    symbols.extend(find_typedefs(docs))
     refs = {}
-    for index, namespace in enumerate(docs.get('namespaces', [])):
-        path = ('namespaces', index)
-        paths.append(path)
-        refs[namespace['name']] = path
-    typedef_paths, typedef_refs = find_typedefs(docs, tuple())
-    paths.extend(typedef_paths)
-    refs.update(typedef_refs)
+    for obj in symbols:
+        refs[obj['name']] = obj
 
-    return refs, paths
+    return refs, symbols
 
 
-def make_text_list(s, tags=None):
+def make_text_list(s, flags=0, param=None):
     paragraphs = s.split('\n\n')
+    param = intern_string(param)
     l = []
     for index, paragraph in enumerate(paragraphs):
-        item = {'text': paragraph.replace('\n', ' ')}
+        item_flags = flags
         if index != 0:
-            item['paragraph'] = True
-        if tags:
-            item.update(tags)
-        l.append(item)
+            item_flags |= PARAGRAPH
+        l.append(Fragment(paragraph.replace('\n', ' '), item_flags, param=param))
     return l
 
 
@@ -75,12 +70,12 @@ def build_function(function):
         })
         desc.extend(make_text_list(
             arg['description'],
-            tags={'param': arg['name']}
+            param=arg['name'],
         ))
     if 'returns' in function:
         desc.extend(make_text_list(
             function['returns']['description'],
-            tags={'return': True}
+            flags=RETURN,
         ))
     return {
         'name': function['name'],
@@ -100,6 +95,24 @@ def build_prop_function(prop, type_obj):
     return build_function(func)
 
 
+# the fields build_function() reads, which are all a ref needs to keep
+_function_fields = ('name', 'description', 'parameters', 'returns')
+
+
+def resolve_prop_function(prop, refs, resolved):
+    # the function form of a property typed by a typedef. the typedef's
+    # fields win over the property's, so unless the property fills in a
+    # field the typedef lacks, every property of that type builds the same
+    # function; it is built once per type into resolved, and each property
+    # gets its own copy of the outer dict to be renamed.
+    type_obj = refs[prop['type']]
+    if any(field in prop and field not in type_obj for field in _function_fields):
+        return build_prop_function(prop, type_obj)
+    if prop['type'] not in resolved:
+        resolved[prop['type']] = build_prop_function({}, type_obj)
+    return dict(resolved[prop['type']])
+
+
 def build_prop(prop):
     desc_paragraphs = make_text_list(prop['description'])
     brief_desc = []
@@ -115,55 +128,204 @@ def build_prop(prop):
     }
 
 
-def walk_docs(path):
-    docs = json.loads(subprocess.check_output(('jsdoc', 'quiet.js', '-r', '-t', 'templates/haruki', '-d', 'console'), cwd=path))
-    namespaces = {}
-    refs, paths = find_symbols(docs)
-    for doc_path in paths:
-        obj = docs
-        for p in doc_path:
-            obj = obj[p]
-        functions = []
-        members = OrderedDict()
-
-        for function in obj.get('functions', []):
-            functions.append(build_function(function))
-        for prop in obj.get('properties', []):
-            if prop.get('type') == 'function':
-                functions.append(build_prop_function(prop, {}))
-            elif prop.get('type') in refs:
-                type_obj = docs
-                for path in refs[prop['type']]:
-                    type_obj = type_obj[path]
-                functions.append(build_prop_function(prop, type_obj))
+class JSONStream(object):
+    # reads a JSON document from a file object a chunk at a time. the
+    # containers the caller asks to step into are walked piece by piece with
+    # object_keys() and array_items(); any other value is decoded whole by
+    # value() as soon as its text has arrived, so only that value's text and
+    # objects are held at once.
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f, chunk_size=65536):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        if self.eof:
+            raise ValueError('unexpected end of JSON input')
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            self.pos = self._whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._fill(self.chunk_size)
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError('expected {chars!r} at {c!r} in JSON input'.format(chars=chars, c=c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
             else:
-                members[prop['name']] = build_prop(prop)
-
-        for func in functions:
-            func['name'] = '.'.join((obj['name'], func['name']))
-
-        desc_paragraphs = make_text_list(obj['description'])
-        brief_desc = []
-        desc = []
-        if desc_paragraphs:
-            brief_desc.append(desc_paragraphs.pop(0))
-            desc.extend(desc_paragraphs)
-        namespace = {
-            'name': obj['name'],
-            'shortdesc': brief_desc,
-            'longdesc': desc,
-            'functions': functions,
-            'members': members,
-            'enums': {},
-            'typedefs': {},
-            'properties': {},
-        }
+                # a number running up to the end of the buffer may continue
+                # in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            # at least double what is buffered, so a value spanning many
+            # chunks is not decoded over and over
+            self._fill(max(self.chunk_size, len(self.buf) - self.pos))
+
+    def object_keys(self):
+        # yields each key, after which the caller reads its value
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                raise ValueError('expected an object key in JSON input')
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def array_items(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._expect(',]') == ']':
+                return
+
+
+def start_symbol(obj):
+    # converts the parts of a namespace or typedef that stand on their own.
+    # properties are kept as they are until every typedef is known, as one
+    # named by a property's type becomes a function.
+    functions = [build_function(function) for function in obj.get('functions', [])]
+    return obj['name'], obj['description'], functions, obj.get('properties', [])
+
+
+def finish_symbol(symbol, refs, resolved):
+    name, description, functions, properties = symbol
+    members = OrderedDict()
+    for prop in properties:
+        if prop.get('type') == 'function':
+            functions.append(build_prop_function(prop, {}))
+        elif prop.get('type') in refs:
+            functions.append(resolve_prop_function(prop, refs, resolved))
+        else:
+            members[prop['name']] = build_prop(prop)
+
+    for func in functions:
+        func['name'] = '.'.join((name, func['name']))
+
+    desc_paragraphs = make_text_list(description)
+    brief_desc = []
+    desc = []
+    if desc_paragraphs:
+        brief_desc.append(desc_paragraphs.pop(0))
+        desc.extend(desc_paragraphs)
+    return {
+        'name': name,
+        'shortdesc': brief_desc,
+        'longdesc': desc,
+        'functions': functions,
+        'members': members,
+        'enums': {},
+        'typedefs': {},
+        'properties': {},
+    }
+
+
+def stream_symbols(command, path):
+    # runs jsdoc and converts each namespace as it comes off the pipe, so
+    # neither the whole output nor the whole object graph is held at once.
+    # typedefs are gathered in the order find_symbols() would list them: the
+    # top level ones, then those below each key in the order the decoded
+    # top level dict would iterate its keys.
+    proc = subprocess.Popen(command, cwd=path, stdout=subprocess.PIPE)
+    symbols = []
+    keys = []
+    root_typedefs = []
+    typedefs = {}
+    error = None
+    try:
+        stream = JSONStream(proc.stdout)
+        for key in stream.object_keys():
+            keys.append(key)
+            if key == 'namespaces':
+                found = typedefs[key] = []
+                for namespace in stream.array_items():
+                    # a property typed by a namespace's name becomes a
+                    # function built from these fields alone, so the rest
+                    # of the namespace can go
+                    ref = dict((field, namespace[field]) for field in _function_fields if field in namespace)
+                    symbols.append((ref, start_symbol(namespace)))
+                    found.extend(find_typedefs(namespace))
+            else:
+                value = stream.value()
+                if key == 'typedefs' and value:
+                    root_typedefs = list(value)
+                typedefs[key] = find_typedefs(value) if isinstance(value, (dict, list)) else []
+    except Exception:
+        # a failing jsdoc cuts its output short, so a parse error only stands
+        # when jsdoc exits cleanly; the rest of the output is read off so
+        # that jsdoc gets to exit rather than dying on a closed pipe
+        error = sys.exc_info()
+        while proc.stdout.read(65536):
+            pass
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+    if error:
+        raise error[0], error[1], error[2]
+
+    found = list(root_typedefs)
+    for key in dict.fromkeys(keys):
+        found.extend(typedefs[key])
+    symbols.extend((obj, start_symbol(obj)) for obj in found)
+    refs = {}
+    for obj, symbol in symbols:
+        refs[obj['name']] = obj
+    return refs, [symbol for obj, symbol in symbols]
+
+
+def walk_docs(path, stream=True):
+    command = ('jsdoc', 'quiet.js', '-r', '-t', 'templates/haruki', '-d', 'console')
+    with tracing.span('jsdoc', path):
+        if stream:
+            refs, symbols = stream_symbols(command, path)
+        else:
+            output = subprocess.check_output(command, cwd=path)
+            refs, objs = find_symbols(json.loads(output))
+            symbols = [start_symbol(obj) for obj in objs]
+
+    namespaces = {}
+    resolved = {}
+    for symbol in symbols:
+        namespace = finish_symbol(symbol, refs, resolved)
         namespaces[namespace['name']] = namespace
 
     return namespaces
 
-
 if __name__ == '__main__':
+    import pprint
     scriptpath = os.path.dirname(os.path.realpath(__file__))
     path = os.path.join(scriptpath, '..', 'quiet-js/')
     pprint.pprint(walk_docs(path))
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+import os
+import os.path
+import tempfile
+
+import tracing
+
+
+# files written through a temporary file get the permissions a plain
+# open() would have given them, rather than mkstemp's 0600
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+class PageBuilder(object):
+    # collects a page as a list of chunks, joined once when the page is
+    # written. the renderers make many small writes per item, which is all
+    # a list append.
+    def __init__(self):
+        self.chunks = []
+        self.write = self.chunks.append
+
+    def writelines(self, lines):
+        self.chunks.extend(lines)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def write_atomically(path, content, prefix='.page-'):
+    # readers of path see either the old file or the new one, never a
+    # partially written file, even if the build is interrupted
+    dirname = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or '.', prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except OSError:
+            mode = 0o666 & ~_umask
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_if_changed(path, content, atomic=True):
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except IOError:
+        pass
+    tracing.count('bytes written', len(content))
+    if atomic:
+        write_atomically(path, content)
+    else:
+        with open(path, 'w') as f:
+            f.write(content)
+    return True
+
+
+@contextmanager
+def open_page(path, changed, atomic=True):
+    # pages are rendered into memory and only hit the disk, in a single
+    # write, when they differ from what is already there, so unchanged pages
+    # keep their mtime. written paths are appended to changed.
+    with tracing.span('render', path):
+        page = PageBuilder()
+        yield page
+    with tracing.span('write', path):
+        if write_if_changed(path, page.getvalue(), atomic=atomic):
+            changed.append(path)
@@ -1,31 +1,48 @@
 from collections import OrderedDict
+import argparse
+import hashlib
 import os.path
+import sys
 
-from doxygen import DoxygenXMLConsumer
-from jsdoc import walk_docs as jsdoc_walk_docs
+from cache import BuildCache, digest_paths
+from desc import EXCEPTION, FIXED, LINKABLE, PARAGRAPH, RETURN
+from pages import open_page
+import ir
+import tracing
 from templates import *
 
 
-reflinks = {}
+scriptpath = os.path.dirname(os.path.realpath(__file__))
 
+# files doxygen may read from a submodule, besides its Doxyfile
+doxygen_extensions = ('.h', '.c', '.hpp', '.cpp', '.java', '.m', '.mm', '.dox', '.md')
 
-def build_text_block(items, fixed=False):
+# the doxydown modules each extractor runs, its own and those it imports
+doxygen_modules = ('doxygen.py', 'desc.py', 'xmlbackend.py', 'tracing.py')
+jsdoc_modules = ('jsdoc.py', 'desc.py', 'tracing.py')
+
+# the extractors and the C symbol index are imported by the loaders and
+# renderers that use them, so generating one target only imports what that
+# target needs
+
+
+def build_text_block(items, fixed=False, reflinks=None):
     elements = []
     for item in items:
         link = None
-        if item.get('linkable') and item.get('ref') in reflinks and not fixed:
-            link = reflinks[item.get('ref')]
+        if item.flags & LINKABLE and reflinks and item.ref in reflinks and not fixed:
+            link = reflinks[item.ref]
             elements.append('[')
-        if item.get('paragraph'):
+        if item.flags & PARAGRAPH:
             elements.append('\n')
-        if item.get('ref') and not fixed:
+        if item.ref and not fixed:
             elements.append('`')
-        if item.get('fixed') and not fixed:
+        if item.flags & FIXED and not fixed:
             elements.append('`')
-        elements.append(item['text'].replace('\n', ''))
-        if item.get('ref') and not fixed:
+        elements.append(item.text.replace('\n', ''))
+        if item.ref and not fixed:
             elements.append('`')
-        if item.get('fixed') and not fixed:
+        if item.flags & FIXED and not fixed:
             elements.append('`')
         if link:
             elements.append(']')
@@ -49,7 +66,7 @@ def build_argstring(args, indentlevel):
                 argstrings.append(', ')
         if arg['type']:
             argstrings.append(build_text_block(arg['type'], fixed=True))
-            if not arg['type'][-1]['text'].endswith(' *'):
+            if not arg['type'][-1].text.endswith(' *'):
                 argstrings.append(' ')
         argstrings.append(arg['name'])
     if optional_level:
@@ -81,7 +98,7 @@ def build_objc_argstring(fragments, args, indentlevel):
     return ''.join(argstrings)
 
 
-def build_function_description(brief_desc, long_desc):
+def build_function_description(brief_desc, long_desc, reflinks=None):
     body = []
     args = OrderedDict()
     ret = []
@@ -89,59 +106,61 @@ def build_function_description(brief_desc, long_desc):
     if brief_desc and not long_desc:
         body.extend(brief_desc)
     for item in long_desc:
-        if item.get('return'):
+        if item.flags & RETURN:
             ret.append(item)
-        elif item.get('exception'):
-            errors.setdefault(item['param'], [])
-            errors[item['param']].append(item)
-        elif item.get('param'):
-            args.setdefault(item['param'], [])
-            args[item['param']].append(item)
+        elif item.flags & EXCEPTION:
+            errors.setdefault(item.param, [])
+            errors[item.param].append(item)
+        elif item.param:
+            args.setdefault(item.param, [])
+            args[item.param].append(item)
         else:
             body.append(item)
 
     components = []
     if body:
-        components.append(build_text_block(body))
+        components.append(build_text_block(body, reflinks=reflinks))
     if args:
         arg_body = []
         for arg, arg_desc in args.iteritems():
-            arg_body.append(func_parameter_template.format(
+            arg_body.append(compiled.func_parameter(
                 name=arg,
-                desc=build_text_block(arg_desc),
+                desc=build_text_block(arg_desc, reflinks=reflinks),
             ))
-        components.append(func_parameters_template.format(
+        components.append(compiled.func_parameters(
             parameters='\n'.join(arg_body),
         ))
     if ret:
-        components.append(func_return_template.format(
-            returns=build_text_block(ret),
+        components.append(compiled.func_return(
+            returns=build_text_block(ret, reflinks=reflinks),
         ))
     if errors:
         error_body = []
         for error, error_desc in errors.iteritems():
-            error_body.append(func_error_template.format(
+            error_body.append(compiled.func_error(
                 name=error,
-                desc=build_text_block(error_desc),
+                desc=build_text_block(error_desc, reflinks=reflinks),
             ))
-        components.append(func_errors_template.format(
+        components.append(compiled.func_errors(
             errors='\n'.join(error_body),
         ))
     return '\n'.join(components)
 
 
-def gen_markdown_function(func, language):
-    func_template = {
-        'c': c_func_template,
-        'objc': objc_method_template,
-        'java': java_func_template,
-        'js': js_func_template,
-    }[language]
+func_templates = {
+    'c': compiled.c_func,
+    'objc': compiled.objc_method,
+    'java': compiled.java_func,
+    'js': compiled.js_func,
+}
+
+
+def gen_markdown_function(func, language, reflinks=None):
     template_kw = {
         'function_name': func['name'],
         'language': language,
         'return_type': build_text_block(func['ret'], fixed=True),
-        'description': build_function_description(func['brief_desc'], func['long_desc']),
+        'description': build_function_description(func['brief_desc'], func['long_desc'], reflinks=reflinks),
     }
     if language == 'objc':
         name_fragments = func['name'].split(':')
@@ -159,17 +178,17 @@ def gen_markdown_function(func, language):
     if language == 'objc':
         template_kw['method_type'] = '+' if func['static'] else '-'
 
-    return func_template.format(**template_kw)
+    return func_templates[language](**template_kw)
 
 
-def gen_markdown_c_struct(struct):
+def gen_markdown_c_struct(struct, reflinks=None):
     members = []
     desc = []
-    desc.append(build_text_block(struct['longdesc']))
+    desc.append(build_text_block(struct['longdesc'], reflinks=reflinks))
     desc.append('\n')
 
     if len(struct['members']) == 0:
-        return c_opaque_typedef_struct_template.format(
+        return compiled.c_opaque_typedef_struct(
             class_name=struct['name'],
             description=''.join(desc),
         )
@@ -177,55 +196,55 @@ def gen_markdown_c_struct(struct):
     for index, member in enumerate(struct['members'].itervalues()):
         if index != 0:
             members.append('\n')
-        members.append(c_struct_member_template.format(
+        members.append(compiled.c_struct_member(
             indent=' '*4,
             type=build_text_block(member['type'], fixed=True),
             name=member['name'],
         ))
-        description = [build_text_block(member['brief_desc']), build_text_block(member['long_desc'])]
-        desc.append(c_struct_member_desc_template.format(
+        description = [build_text_block(member['brief_desc'], reflinks=reflinks), build_text_block(member['long_desc'], reflinks=reflinks)]
+        desc.append(compiled.c_struct_member_desc(
             name=member['name'],
             description='\n'.join(description),
         ))
-    return c_typedef_struct_template.format(
+    return compiled.c_typedef_struct(
         class_name=struct['name'],
         struct_body=''.join(members),
         description=''.join(desc),
     )
 
 
-def gen_markdown_c_enum(enum):
+def gen_markdown_c_enum(enum, reflinks=None):
     values = []
     desc = []
-    desc.append(build_text_block(enum['long_desc']))
+    desc.append(build_text_block(enum['long_desc'], reflinks=reflinks))
     desc.append('\n')
 
     for index, value in enumerate(enum['values']):
         if index != 0:
             values.append(',\n')
         initializer = value['initializer']
-        values.append(c_enum_value_template.format(
+        values.append(compiled.c_enum_value(
             indent=' '*4,
             value_name=value['name'],
             initializer=' ' + initializer if initializer else '',
         ))
-        description = [build_text_block(value['brief_desc']), build_text_block(value['long_desc'])]
-        desc.append(c_enum_value_desc_template.format(
+        description = [build_text_block(value['brief_desc'], reflinks=reflinks), build_text_block(value['long_desc'], reflinks=reflinks)]
+        desc.append(compiled.c_enum_value_desc(
             name=value['name'],
             description='\n'.join(description),
         ))
-    return c_enum_template.format(
+    return compiled.c_enum(
         enum_name=enum['name'],
         enum_body=''.join(values),
         description=''.join(desc),
     )
 
 
-def gen_markdown_c_typedef(typedef):
-    return c_typedef_template.format(
-        type=build_text_block(typedef['type']),
+def gen_markdown_c_typedef(typedef, reflinks=None):
+    return compiled.c_typedef(
+        type=build_text_block(typedef['type'], reflinks=reflinks),
         name=typedef['name'],
-        description=build_text_block(typedef['long_desc']),
+        description=build_text_block(typedef['long_desc'], reflinks=reflinks),
     )
 
 
@@ -241,13 +260,13 @@ def gen_markdown_java_class(klass):
     for index, member in enumerate(klass['members'].itervalues()):
         if index != 0:
             members.append('\n')
-        members.append(java_class_member_template.format(
+        members.append(compiled.java_class_member(
             indent=' '*4,
             type=build_text_block(member['type']),
             name=member['name'],
         ))
         description = [build_text_block(member['brief_desc']), build_text_block(member['long_desc'])]
-        desc.append(java_class_member_desc_template.format(
+        desc.append(compiled.java_class_member_desc(
             name=member['name'],
             description='\n'.join(description),
         ))
@@ -261,7 +280,7 @@ def gen_markdown_java_class(klass):
         typestrings.append(method['protection'])
         if method['ret']:
             typestrings.append(build_text_block(method['ret'], fixed=True))
-        methods.append(java_class_method_template.format(
+        methods.append(compiled.java_class_method(
             indent=' '*4,
             type=' '.join(typestrings),
             name=method['name'],
@@ -276,7 +295,7 @@ def gen_markdown_java_class(klass):
     declaration.append('class')
     declaration.append(klass['name'])
 
-    return java_class_template.format(
+    return compiled.java_class(
         class_name=klass['name'],
         class_declaration=' '.join(declaration),
         class_body=''.join(members),
@@ -296,13 +315,13 @@ def gen_markdown_objc_interface(interface):
     for index, property in enumerate(interface['properties'].itervalues()):
         if index != 0:
             properties.append('\n')
-        properties.append(objc_interface_property_template.format(
+        properties.append(compiled.objc_interface_property(
             indent=' '*4,
             type=build_text_block(property['type']),
             name=property['name'],
         ))
         description = [build_text_block(property['brief_desc']), build_text_block(property['long_desc'])]
-        desc.append(objc_interface_property_desc_template.format(
+        desc.append(compiled.objc_interface_property_desc(
             name=property['name'],
             description='\n'.join(description),
         ))
@@ -314,7 +333,7 @@ def gen_markdown_objc_interface(interface):
         name_fragments = method['name'].split(':')
         if (len(name_fragments) > 1):
             name_fragments = [f + ':' for f in name_fragments]
-        methods.append(objc_interface_method_template.format(
+        methods.append(compiled.objc_interface_method(
             method_type='+' if method['static'] else '-',
             return_type=build_text_block(method['ret']),
             base_name=name_fragments[0],
@@ -323,7 +342,7 @@ def gen_markdown_objc_interface(interface):
 
     properties.extend(methods)
 
-    return objc_interface_template.format(
+    return compiled.objc_interface(
         class_name=interface['name'],
         base_name=interface['base'],
         interface_body=''.join(properties),
@@ -338,127 +357,179 @@ def gen_markdown_js_object(obj):
 
     for member in obj['members'].itervalues():
         description = [build_text_block(member['brief_desc']), build_text_block(member['long_desc'])]
-        desc.append(js_object_property_desc_template.format(
+        desc.append(compiled.js_object_property_desc(
             name=member['name'],
             description='\n'.join(description),
         ))
 
     for method in obj['functions']:
-        desc.append(js_object_method_desc_template.format(
+        desc.append(compiled.js_object_method_desc(
             name=method['name'],
             description=build_text_block(method['brief_desc']),
         ))
 
-    return js_object_template.format(
+    return compiled.js_object(
         object_name=obj['name'],
         description=''.join(desc),
     )
 
 
-def gen_markdown_file_c(docs, filename, content):
-    with open(filename, 'w') as f:
+def _docs_digest(quiet_path, inputs, modules, extensions=None):
+    # the extractor's source is part of the key so that parser changes
+    # invalidate previously cached docs
+    return hashlib.sha1(
+        digest_paths(quiet_path, inputs, extensions=extensions, exclude=('docs',)) +
+        digest_paths(scriptpath, modules)
+    ).hexdigest()
+
+
+def load_doxygen_docs(quiet_path, name, cache=None, workers=None, pool=None):
+    from doxygen import DoxygenXMLConsumer
+    def build():
+        docs = DoxygenXMLConsumer(os.path.join(quiet_path, 'docs/xml/'), gen_docs=quiet_path,
+                                  workers=workers, pool=pool).docs
+        if workers and workers > 1:
+            # spread over the workers up front rather than parsed one at a
+            # time as the renderer looks compounds up
+            docs.load_all()
+        return docs
+    if cache is None:
+        return build()
+    # compounds are read back from the cache entry as the renderer looks
+    # them up, and doxygen only runs again for one the entry lacks
+    digest = _docs_digest(quiet_path, ('Doxyfile', '.'), doxygen_modules, extensions=doxygen_extensions)
+    return cache.get_mapping(name, digest, build)
+
+
+def load_jsdoc_docs(quiet_path, name, cache=None, workers=None, pool=None):
+    # jsdoc's output is read in one pass, so workers and pool go unused
+    from jsdoc import walk_docs as jsdoc_walk_docs
+    def build():
+        return jsdoc_walk_docs(quiet_path)
+    if cache is None:
+        return build()
+    digest = _docs_digest(quiet_path, ('quiet.js', 'templates/haruki'), jsdoc_modules)
+    return cache.get(name, digest, build)
+
+
+def gen_markdown_file_c(filename, items, changed, reflinks=None):
+    with open_page(filename, changed) as f:
         f.write(md_header)
-        for path in content:
-            item = docs
-            for part in path:
-                item = item[part]
+        for item in items:
             if item['kind'] == 'function':
-                f.write(gen_markdown_function(item, 'c'))
+                f.write(gen_markdown_function(item, 'c', reflinks=reflinks))
             elif item['kind'] == 'struct':
-                f.write(gen_markdown_c_struct(item))
+                f.write(gen_markdown_c_struct(item, reflinks=reflinks))
             elif item['kind'] == 'enum':
-                f.write(gen_markdown_c_enum(item))
+                f.write(gen_markdown_c_enum(item, reflinks=reflinks))
             elif item['kind'] == 'typedef':
-                f.write(gen_markdown_c_typedef(item))
+                f.write(gen_markdown_c_typedef(item, reflinks=reflinks))
             else:
                 raise Exception('unrecognized item kind ' + item['kind'])
 
 
-def gen_markdown_c(quiet_path, docs_path):
-    docs = DoxygenXMLConsumer(os.path.join(quiet_path, 'docs/xml/'), gen_docs=quiet_path).docs
-    content = {
-        'transmitting': [
-            ('quiet_portaudio_encoder',),
-        ],
-        'receiving': [
-            ('quiet_portaudio_decoder',),
-        ],
-        'encoding': [
-            ('quiet.h', 'typedefs', 'quiet_sample_t'),
-            ('quiet_encoder',),
-        ],
-        'decoding': [
-            ('quiet_decoder',),
-        ],
-        'configuration': [],
-        'errors': [
-            ('quiet.h', 'enums', 'quiet_error',),
-        ],
-        'frame-stats': [
-            ('quiet_decoder_frame_stats',),
-            ('quiet_complex',),
-        ],
-    }
-
-    for index, func in enumerate(docs['quiet-portaudio.h']['functions']):
-        name = func['name']
-        if name.startswith('quiet_portaudio_encoder_'):
-            content['transmitting'].append(('quiet-portaudio.h', 'functions', index))
-        elif name.startswith('quiet_portaudio_decoder_'):
-            content['receiving'].append(('quiet-portaudio.h', 'functions', index))
-    for index, func in enumerate(docs['quiet.h']['functions']):
-        name = func['name']
-        if name.startswith('quiet_encoder_') and not name.startswith('quiet_encoder_profile'):
-            content['encoding'].append(('quiet.h', 'functions', index))
-        elif name.startswith('quiet_decoder_') and not name.startswith('quiet_decoder_profile'):
-            content['decoding'].append(('quiet.h', 'functions', index))
-        elif name.startswith('quiet_encoder_profile'):
-            content['configuration'].append(('quiet.h', 'functions', index))
-        elif name.startswith('quiet_decoder_profile'):
-            content['configuration'].append(('quiet.h', 'functions', index))
-        elif name == 'quiet_get_last_error':
-            content['errors'].append(('quiet.h', 'functions', index))
-
-    content['configuration'].append(('quiet_encoder_options',))
-    content['configuration'].append(('quiet_decoder_options',))
-    content['configuration'].append(('quiet_modulator_options',))
-    content['configuration'].append(('quiet_demodulator_options',))
-    content['configuration'].append(('quiet.h', 'enums', 'quiet_encoding_t',))
-    content['configuration'].append(('quiet_ofdm_options',))
-    content['configuration'].append(('quiet.h', 'enums', 'quiet_checksum_scheme_t',))
-    content['configuration'].append(('quiet.h', 'enums', 'quiet_error_correction_scheme_t',))
-    content['configuration'].append(('quiet.h', 'enums', 'quiet_modulation_scheme_t',))
-    content['configuration'].append(('quiet_dc_filter_options',))
-    content['configuration'].append(('quiet_resampler_options',))
-
-    indices = {}
-    for page, items in content.iteritems():
-        for item in items:
-            reflinks[item[-1]] = '{page}/#{item}'.format(page=page, item=item[-1])
+# (compound, function name pattern, page) rules placing the C functions.
+# a trailing * matches any suffix, and a function matched by several rules
+# goes to the most specific one.
+c_function_routes = (
+    ('quiet-portaudio.h', 'quiet_portaudio_encoder_*', 'transmitting'),
+    ('quiet-portaudio.h', 'quiet_portaudio_decoder_*', 'receiving'),
+    ('quiet.h', 'quiet_encoder_*', 'encoding'),
+    ('quiet.h', 'quiet_decoder_*', 'decoding'),
+    ('quiet.h', 'quiet_encoder_profile*', 'configuration'),
+    ('quiet.h', 'quiet_decoder_profile*', 'configuration'),
+    ('quiet.h', 'quiet_get_last_error', 'errors'),
+)
+
+
+# marks where the functions routed to a page go among its other symbols
+routed_functions = None
+
+
+# the C pages, their files, and the qualified names of the symbols on each
+c_pages = OrderedDict((
+    ('transmitting', ('transmitting.md', (
+        'quiet_portaudio_encoder',
+        routed_functions,
+    ))),
+    ('receiving', ('receiving.md', (
+        'quiet_portaudio_decoder',
+        routed_functions,
+    ))),
+    ('encoding', ('encoding.md', (
+        'quiet.h::quiet_sample_t',
+        'quiet_encoder',
+        routed_functions,
+    ))),
+    ('decoding', ('decoding.md', (
+        'quiet_decoder',
+        routed_functions,
+    ))),
+    ('configuration', (os.path.join('configuration', 'auto.md'), (
+        routed_functions,
+        'quiet_encoder_options',
+        'quiet_decoder_options',
+        'quiet_modulator_options',
+        'quiet_demodulator_options',
+        'quiet.h::quiet_encoding_t',
+        'quiet_ofdm_options',
+        'quiet.h::quiet_checksum_scheme_t',
+        'quiet.h::quiet_error_correction_scheme_t',
+        'quiet.h::quiet_modulation_scheme_t',
+        'quiet_dc_filter_options',
+        'quiet_resampler_options',
+    ))),
+    ('errors', ('errors.md', (
+        'quiet.h::quiet_error',
+        routed_functions,
+    ))),
+    ('frame-stats', ('frame-stats.md', (
+        'quiet_decoder_frame_stats',
+        'quiet_complex',
+    ))),
+))
+
+
+def gen_markdown_c(docs, docs_path):
+    from symbols import SymbolIndex, route
+    index = SymbolIndex(docs)
+    functions = route(index, c_function_routes, kind='function')
+    content = OrderedDict()
+    for page, (filename, names) in c_pages.iteritems():
+        content[page] = []
+        for name in names:
+            if name is routed_functions:
+                content[page].extend(functions.get(page, []))
+            else:
+                content[page].append(index[name])
 
+    # links are only resolved against this target's own pages
+    reflinks = {}
+    for page, symbols in content.iteritems():
+        for symbol in symbols:
+            reflinks[symbol.name] = '{page}/#{item}'.format(page=page, item=symbol.name)
 
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'transmitting.md'), content['transmitting'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'receiving.md',), content['receiving'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'encoding.md',), content['encoding'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'decoding.md',), content['decoding'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'configuration', 'auto.md',), content['configuration'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'errors.md',), content['errors'])
-    gen_markdown_file_c(docs, os.path.join(docs_path, 'frame-stats.md',), content['frame-stats'])
+    changed = []
+    for page, (filename, names) in c_pages.iteritems():
+        gen_markdown_file_c(os.path.join(docs_path, filename),
+                            [symbol.item for symbol in content[page]],
+                            changed, reflinks=reflinks)
+    return changed
 
 
-def gen_markdown_android(quiet_path, docs_path):
-    docs = DoxygenXMLConsumer(os.path.join(quiet_path, 'docs/xml/'), gen_docs=quiet_path).docs
-    with open(os.path.join(docs_path, 'transmitting.md'), 'w') as f:
+def gen_markdown_android(docs, docs_path):
+    changed = []
+    with open_page(os.path.join(docs_path, 'transmitting.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_java_class(docs['FrameTransmitter']))
         for func in docs['FrameTransmitter']['functions']:
             f.write(gen_markdown_function(func, 'java'))
-    with open(os.path.join(docs_path, 'receiving.md'), 'w') as f:
+    with open_page(os.path.join(docs_path, 'receiving.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_java_class(docs['FrameReceiver']))
         for func in docs['FrameReceiver']['functions']:
             f.write(gen_markdown_function(func, 'java'))
-    with open(os.path.join(docs_path, 'configuration', 'auto.md'), 'w') as f:
+    with open_page(os.path.join(docs_path, 'configuration', 'auto.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_java_class(docs['FrameTransmitterConfig']))
         for func in docs['FrameTransmitterConfig']['functions']:
@@ -466,21 +537,22 @@ def gen_markdown_android(quiet_path, docs_path):
         f.write(gen_markdown_java_class(docs['FrameReceiverConfig']))
         for func in docs['FrameReceiverConfig']['functions']:
             f.write(gen_markdown_function(func, 'java'))
+    return changed
 
 
-def gen_markdown_ios(quiet_path, docs_path):
-    docs = DoxygenXMLConsumer(os.path.join(quiet_path, 'docs/xml/'), gen_docs=quiet_path).docs
-    with open(os.path.join(docs_path, 'transmitting.md'), 'w') as f:
+def gen_markdown_ios(docs, docs_path):
+    changed = []
+    with open_page(os.path.join(docs_path, 'transmitting.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_objc_interface(docs['QMFrameTransmitter']))
         for func in docs['QMFrameTransmitter']['functions']:
             f.write(gen_markdown_function(func, 'objc'))
-    with open(os.path.join(docs_path, 'receiving.md'), 'w') as f:
+    with open_page(os.path.join(docs_path, 'receiving.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_objc_interface(docs['QMFrameReceiver']))
         for func in docs['QMFrameReceiver']['functions']:
             f.write(gen_markdown_function(func, 'objc'))
-    with open(os.path.join(docs_path, 'configuration', 'auto.md'), 'w') as f:
+    with open_page(os.path.join(docs_path, 'configuration', 'auto.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_objc_interface(docs['QMTransmitterConfig']))
         for func in docs['QMTransmitterConfig']['functions']:
@@ -488,11 +560,12 @@ def gen_markdown_ios(quiet_path, docs_path):
         f.write(gen_markdown_objc_interface(docs['QMReceiverConfig']))
         for func in docs['QMReceiverConfig']['functions']:
             f.write(gen_markdown_function(func, 'objc'))
+    return changed
 
 
-def gen_markdown_js(quiet_path, docs_path):
-    docs = jsdoc_walk_docs(quiet_path)
-    with open(os.path.join(docs_path, 'transmitting.md'), 'w') as f:
+def gen_markdown_js(docs, docs_path):
+    changed = []
+    with open_page(os.path.join(docs_path, 'transmitting.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_js_object(docs['Transmitter']))
         for func in docs['Quiet']['functions']:
@@ -500,7 +573,7 @@ def gen_markdown_js(quiet_path, docs_path):
                 f.write(gen_markdown_function(func, 'js'))
         for func in docs['Transmitter']['functions']:
             f.write(gen_markdown_function(func, 'js'))
-    with open(os.path.join(docs_path, 'receiving.md'), 'w') as f:
+    with open_page(os.path.join(docs_path, 'receiving.md'), changed) as f:
         f.write(md_header)
         f.write(gen_markdown_js_object(docs['Receiver']))
         for func in docs['Quiet']['functions']:
@@ -508,27 +581,108 @@ def gen_markdown_js(quiet_path, docs_path):
                 f.write(gen_markdown_function(func, 'js'))
         for func in docs['Receiver']['functions']:
             f.write(gen_markdown_function(func, 'js'))
-
-
-def gen_markdown(path):
-    gen_markdown_c(
-            os.path.join(path, 'quiet'),
-            os.path.join(path, 'docs/quiet')
-    )
-    gen_markdown_android(
-            os.path.join(path, 'org.quietmodem.Quiet'),
-            os.path.join(path, 'docs/org.quietmodem.Quiet'),
-    )
-    gen_markdown_ios(
-            os.path.join(path, 'QuietModemKit'),
-            os.path.join(path, 'docs/QuietModemKit'),
-    )
-    gen_markdown_js(
-            os.path.join(path, 'quiet-js'),
-            os.path.join(path, 'docs/quiet-js'),
-    )
+    return changed
+
+
+# target name -> (extractor, renderer, submodule directory)
+# each target reads its own submodule and writes to its own docs directory
+targets = OrderedDict((
+    ('c', (load_doxygen_docs, gen_markdown_c, 'quiet')),
+    ('android', (load_doxygen_docs, gen_markdown_android, 'org.quietmodem.Quiet')),
+    ('ios', (load_doxygen_docs, gen_markdown_ios, 'QuietModemKit')),
+    ('js', (load_jsdoc_docs, gen_markdown_js, 'quiet-js')),
+))
+
+
+def _gen_target(job):
+    path, name, cache, save_ir, from_ir, workers, pool = job
+    with tracing.span('target', name):
+        load_docs, gen, subdir = targets[name]
+        if from_ir:
+            ir_path = os.path.join(from_ir, name + '.ir')
+            docs = ir.load(ir_path)
+            if docs is None:
+                raise Exception('no usable intermediate docs at ' + ir_path)
+        else:
+            docs = load_docs(os.path.join(path, subdir), name, cache=cache, workers=workers, pool=pool)
+        if save_ir:
+            ir.dump(docs, os.path.join(save_ir, name + '.ir'))
+        return gen(docs, os.path.join(path, 'docs', subdir))
+
+
+def gen_markdown(path, names=None, cache=None, save_ir=None, from_ir=None, workers=None):
+    # a target named twice is generated once, as two threads running it
+    # would write the same pages and cache entry
+    names = list(OrderedDict.fromkeys(names or targets.keys()))
+    if save_ir and not os.path.isdir(save_ir):
+        os.makedirs(save_ir)
+
+    pool = None
+    if workers and workers > 1 and not from_ir:
+        # the parsing processes are forked here, before the target threads
+        # start, as a fork taken while another thread holds a lock (tracing's,
+        # say) leaves that lock held for good in the child. the targets share
+        # them.
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+    jobs = [(path, name, cache, save_ir, from_ir, workers, pool) for name in names]
+
+    try:
+        if len(jobs) == 1:
+            changed = [_gen_target(jobs[0])]
+        else:
+            # the targets spend most of their time waiting on doxygen/jsdoc,
+            # so a thread per target lets those runs and the parsing that
+            # follows overlap
+            from multiprocessing.pool import ThreadPool
+            threads = ThreadPool(len(jobs))
+            try:
+                changed = threads.map(_gen_target, jobs)
+            finally:
+                threads.close()
+                threads.join()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # pages that were actually rewritten, in target order
+    return [page for pages in changed for page in pages]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the API reference markdown for the Quiet projects.')
+    parser.add_argument('targets', nargs='*', metavar='TARGET',
+                        help='targets to generate, out of ' + ', '.join(targets) + ' (default: all of them)')
+    parser.add_argument('--save-ir', metavar='DIR',
+                        help='save the parsed docs of each target to DIR')
+    parser.add_argument('--from-ir', metavar='DIR',
+                        help='render from docs saved with --save-ir instead of running the extractors')
+    parser.add_argument('--workers', type=int,
+                        help='processes to parse the Doxygen XML of the targets with (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always run the extractors, without reading or writing .doxydown-cache')
+    parser.add_argument('--trace', metavar='FILE', default=os.environ.get('DOXYDOWN_TRACE'),
+                        help='write a Chrome trace of the run to FILE and print a summary '
+                             '(default: $DOXYDOWN_TRACE)')
+    args = parser.parse_args(argv)
+    for name in args.targets:
+        if name not in targets:
+            parser.error('unknown target ' + name)
+
+    if args.trace:
+        tracing.enable()
+    root = os.path.join(scriptpath, '..')
+    cache = None if args.no_cache else BuildCache(os.path.join(root, '.doxydown-cache'))
+    changed = gen_markdown(root, names=args.targets, cache=cache,
+                           save_ir=args.save_ir, from_ir=args.from_ir, workers=args.workers)
+    for page in changed:
+        print(os.path.relpath(page, root))
+    if args.trace:
+        tracing.write(args.trace)
+        print(tracing.summary())
+    return 0
 
 
 if __name__ == '__main__':
-    scriptpath = os.path.dirname(os.path.realpath(__file__))
-    gen_markdown(os.path.join(scriptpath, '..'))
+    sys.exit(main())
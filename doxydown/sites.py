@@ -0,0 +1,225 @@
+from multiprocessing.pool import ThreadPool
+import argparse
+import copy
+import io
+import logging
+import os
+import os.path
+import subprocess
+import threading
+
+import mkdocs
+import yaml
+
+
+# the driver reuses the build internals of mkdocs 0.16 (its nav module, the
+# page and template helpers of commands.build, the mkdocs_templates config
+# key and the shared config schema worked around in load_site), none of
+# which survived into later versions. on any other version build_sites
+# falls back to running `mkdocs build` once per site.
+supported_mkdocs = '0.16'
+in_process = mkdocs.__version__.split('.')[:2] == supported_mkdocs.split('.')
+
+if in_process:
+    import jinja2
+    import markdown
+    from mkdocs import nav, search, toc, utils
+    from mkdocs.commands.build import (build_extra_templates, build_template, get_complete_paths,
+                                       get_global_context, get_page_context)
+    from mkdocs.config import load_config
+    from mkdocs.relative_path_ext import RelativePathExtension
+    from mkdocs.utils import filters
+
+    from content_embedder import rendering_page
+
+
+# builds every site in one interpreter instead of one mkdocs process per
+# site, which re-imported markdown and the extensions, re-read the theme and
+# re-created every extension for every page. the sites share one jinja
+# environment per theme, so each template is compiled once, and each site
+# converts all of its pages with a single Markdown instance. extension
+# instances are not shared between sites, as some of them (toc) keep a
+# reference to the Markdown instance they were registered with.
+
+
+scriptpath = os.path.dirname(os.path.realpath(__file__))
+site_configs_path = os.path.join(scriptpath, '..', 'site_configs')
+default_sites = ('quiet.yml', 'quiet-js.yml', 'org.quietmodem.Quiet.yml', 'QuietModemKit.yml')
+
+log = logging.getLogger(__name__)
+
+
+def _require_in_process():
+    if not in_process:
+        raise Exception('building sites in process needs mkdocs {supported}.x, found mkdocs {version}; '
+                        'build them with `mkdocs build` instead'.format(supported=supported_mkdocs,
+                                                                         version=mkdocs.__version__))
+
+
+def load_site(config_path):
+    _require_in_process()
+    # mkdocs resolves the paths in a config against the working directory,
+    # and the extensions take theirs as they are, so both are made absolute
+    # here against the config's own directory
+    config_path = os.path.abspath(config_path)
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(config_path))
+    try:
+        config = load_config(config_file=config_path)
+        # mkdocs loads the extra: section and the extension configs into
+        # its module level schema, so the next config loaded in this process
+        # would overwrite this one's. each config gets its own copies.
+        for key in ('extra', 'mdx_configs'):
+            shared = config[key]
+            config[key] = copy.deepcopy(dict(shared))
+            shared.clear()
+        embedder = config['mdx_configs'].get('content_embedder')
+        if embedder and 'docs_dir' in embedder:
+            embedder['docs_dir'] = os.path.abspath(embedder['docs_dir'])
+    finally:
+        os.chdir(cwd)
+    return config
+
+
+def site_paths(config_path):
+    # the directories a site is built from, read straight from its config
+    # rather than through load_site, so that they can be had whichever mkdocs
+    # is installed: its docs_dir, its theme_dir (without the assets mkdocs
+    # adds of its own) and the directory its embedded fragments come from,
+    # all absolute
+    config_path = os.path.abspath(config_path)
+    config_dir = os.path.dirname(config_path)
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+    docs_dir = os.path.abspath(os.path.join(config_dir, config.get('docs_dir', 'docs')))
+    theme_dirs = []
+    if config.get('theme_dir'):
+        theme_dirs.append(os.path.abspath(os.path.join(config_dir, config['theme_dir'])))
+    fragments_dir = docs_dir
+    for extension in config.get('markdown_extensions') or ():
+        if isinstance(extension, dict) and 'content_embedder' in extension:
+            embedder = extension['content_embedder'] or {}
+            if 'docs_dir' in embedder:
+                fragments_dir = os.path.abspath(os.path.join(config_dir, embedder['docs_dir']))
+    return {
+        'docs_dir': docs_dir,
+        'theme_dir': theme_dirs,
+        'fragments_dir': fragments_dir,
+    }
+
+
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def theme_environment(config):
+    search_path = tuple(config['theme_dir'] + [config['mkdocs_templates']])
+    with _environments_lock:
+        if search_path not in _environments:
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(list(search_path)))
+            env.filters['tojson'] = filters.tojson
+            _environments[search_path] = env
+        return _environments[search_path]
+
+
+def convert_page(md, source):
+    md.reset()
+    html_content = md.convert(source)
+    meta = getattr(md, 'Meta', {})
+    table_of_contents = toc.TableOfContents(getattr(md, 'toc', ''))
+    return html_content, table_of_contents, meta
+
+
+def build_page(page, config, site_navigation, env, md):
+    input_path, output_path = get_complete_paths(config, page)
+    with io.open(input_path, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    with rendering_page(input_path):
+        html_content, table_of_contents, meta = convert_page(md, source)
+
+    context = get_global_context(site_navigation, config)
+    context.update(get_page_context(page, html_content, table_of_contents, meta, config))
+    if 'template' in meta:
+        template = env.get_template(meta['template'][0])
+    else:
+        template = env.get_template('main.html')
+    utils.write_file(template.render(context).encode('utf-8'), output_path)
+    return html_content, table_of_contents
+
+
+def build_site(config):
+    # the same steps as `mkdocs build`, with the shared environment
+    _require_in_process()
+    log.info("Building documentation to directory: %s", config['site_dir'])
+    utils.clean_directory(config['site_dir'])
+    for theme_dir in reversed(config['theme_dir']):
+        utils.copy_media_files(theme_dir, config['site_dir'], exclude=['*.py', '*.pyc', '*.html'])
+    utils.copy_media_files(config['docs_dir'], config['site_dir'])
+
+    site_navigation = nav.SiteNavigation(config['pages'], config['use_directory_urls'])
+    env = theme_environment(config)
+    md = markdown.Markdown(extensions=[RelativePathExtension(site_navigation, config['strict'])] +
+                           config['markdown_extensions'],
+                           extension_configs=config['mdx_configs'])
+
+    site_navigation.url_context.force_abs_urls = True
+    default_base = site_navigation.url_context.base_path
+    site_navigation.url_context.base_path = utils.urlparse(config['site_url']).path
+    build_template('404.html', env, config, site_navigation)
+    site_navigation.url_context.force_abs_urls = False
+    site_navigation.url_context.base_path = default_base
+
+    build_template('search.html', env, config, site_navigation)
+    build_template('sitemap.xml', env, config, site_navigation)
+    build_extra_templates(config['extra_templates'], config, site_navigation)
+
+    search_index = search.SearchIndex()
+    # the navigation tracks the page being walked, so a site's pages are
+    # built one after another
+    for page in site_navigation.walk_pages():
+        try:
+            html_content, table_of_contents = build_page(page, config, site_navigation, env, md)
+        except Exception:
+            log.error("Error building page %s", page.input_path)
+            raise
+        search_index.add_entry_from_context(page, html_content, table_of_contents)
+
+    json_output_path = os.path.join(config['site_dir'], 'mkdocs', 'search_index.json')
+    utils.write_file(search_index.generate_search_index().encode('utf-8'), json_output_path)
+    return config['site_dir']
+
+
+def build_site_with_mkdocs(config_path):
+    config_path = os.path.abspath(config_path)
+    subprocess.check_call(('mkdocs', 'build', '-f', os.path.basename(config_path)),
+                          cwd=os.path.dirname(config_path))
+
+
+def build_sites(config_paths, workers=None):
+    if not in_process:
+        log.warning("mkdocs %s is not %s.x; building each site with `mkdocs build`",
+                    mkdocs.__version__, supported_mkdocs)
+        for config_path in config_paths:
+            build_site_with_mkdocs(config_path)
+        return
+    configs = [load_site(config_path) for config_path in config_paths]
+    pool = ThreadPool(workers or len(configs))
+    try:
+        return pool.map(build_site, configs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the Quiet documentation sites in one process.')
+    parser.add_argument('configs', nargs='*', metavar='CONFIG',
+                        help='mkdocs configs to build (default: every site in site_configs)')
+    parser.add_argument('--workers', type=int,
+                        help='sites to build at once (default: all of them)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config_paths = args.configs or [os.path.join(site_configs_path, name) for name in default_sites]
+    build_sites(config_paths, workers=args.workers)
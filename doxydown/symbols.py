@@ -0,0 +1,103 @@
+from bisect import bisect_left
+from collections import namedtuple
+
+
+# qualified_name is the compound's own name for compounds and
+# 'compound::name' for everything declared inside one. order is the
+# symbol's position in the index, which follows the docs.
+Symbol = namedtuple('Symbol', ('name', 'qualified_name', 'kind', 'compound', 'item', 'order'))
+
+
+_sections = ('members', 'enums', 'typedefs', 'properties')
+
+
+class SymbolIndex(object):
+    # built once over parsed docs, as produced by DoxygenXMLConsumer or
+    # jsdoc.walk_docs. lookups by qualified name, kind and compound are
+    # dict lookups; name prefixes are found by bisecting the sorted names.
+    def __init__(self, docs):
+        self._symbols = []
+        self._by_qualified_name = {}
+        self._by_kind = {}
+        self._by_compound = {}
+        for compound in sorted(docs):
+            struct = docs[compound]
+            self._add(compound, compound, struct.get('kind'), None, struct)
+            for func in struct['functions']:
+                self._add(func['name'], compound + '::' + func['name'], 'function', compound, func)
+            for section in _sections:
+                for name, item in struct[section].iteritems():
+                    self._add(name, compound + '::' + name, item.get('kind'), compound, item)
+        self._names = sorted((symbol.name, symbol.order) for symbol in self._symbols)
+
+    def _add(self, name, qualified_name, kind, compound, item):
+        symbol = Symbol(name, qualified_name, kind, compound, item, len(self._symbols))
+        self._symbols.append(symbol)
+        # overloads share a qualified name; the first one declared wins here
+        # and the rest are still reachable by kind, compound and prefix
+        self._by_qualified_name.setdefault(qualified_name, symbol)
+        self._by_kind.setdefault(kind, []).append(symbol)
+        self._by_compound.setdefault(compound, []).append(symbol)
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def __contains__(self, qualified_name):
+        return qualified_name in self._by_qualified_name
+
+    def __getitem__(self, qualified_name):
+        return self._by_qualified_name[qualified_name]
+
+    def get(self, qualified_name, default=None):
+        return self._by_qualified_name.get(qualified_name, default)
+
+    def of_kind(self, kind):
+        return self._by_kind.get(kind, [])
+
+    def in_compound(self, compound):
+        return self._by_compound.get(compound, [])
+
+    def with_prefix(self, prefix, compound=None, kind=None):
+        # symbols whose unqualified name starts with prefix, in index order
+        found = []
+        names = self._names
+        i = bisect_left(names, (prefix,))
+        while i < len(names) and names[i][0].startswith(prefix):
+            symbol = self._symbols[names[i][1]]
+            i += 1
+            if compound is not None and symbol.compound != compound:
+                continue
+            if kind is not None and symbol.kind != kind:
+                continue
+            found.append(symbol)
+        found.sort(key=lambda symbol: symbol.order)
+        return found
+
+
+def route(index, rules, kind=None):
+    # assigns symbols to pages. rules are (compound, pattern, page) triples
+    # where pattern is a name, or a name prefix followed by '*'. a symbol
+    # matched by several rules goes to the most specific one: exact names
+    # first, then the longest prefix. returns page -> symbols in index order.
+    best = {}
+    for compound, pattern, page in rules:
+        if pattern.endswith('*'):
+            prefix = pattern[:-1]
+            specificity = (False, len(prefix))
+            matches = index.with_prefix(prefix, compound=compound, kind=kind)
+        else:
+            specificity = (True, len(pattern))
+            symbol = index.get(compound + '::' + pattern if compound else pattern)
+            matches = [symbol] if symbol and (kind is None or symbol.kind == kind) else []
+        for symbol in matches:
+            if symbol.order not in best or specificity > best[symbol.order][0]:
+                best[symbol.order] = (specificity, page, symbol)
+
+    pages = {}
+    for order in sorted(best):
+        specificity, page, symbol = best[order]
+        pages.setdefault(page, []).append(symbol)
+    return pages
@@ -1,3 +1,6 @@
+import string
+
+
 md_header = '''<!---
 This file is automatically generated by the Doxydown scripts.
 Do not edit this file as it will be overwritten the next time
@@ -218,3 +221,48 @@ js_object_method_desc_template = '''### {name}()
 
 {description}
 '''
+
+
+def compile_template(source):
+    # turns a template into a function taking its fields as keyword
+    # arguments, ignoring any others as str.format does. the template is
+    # parsed once into a %-format string, so rendering is a single % over
+    # the field values instead of str.format parsing the template again on
+    # every call. only plain {name} fields are supported.
+    segments = []
+    fields = []
+    for literal, field, spec, conversion in string.Formatter().parse(source):
+        segments.append(literal.replace('%', '%%'))
+        if field is None:
+            continue
+        if spec or conversion or not field.replace('_', 'x').isalnum() or field[0].isdigit():
+            raise ValueError('unsupported template field {{{field}}}'.format(field=field))
+        segments.append('%s')
+        fields.append(field)
+
+    names = sorted(set(fields))
+    code = 'def render({args}**unused):\n    return _format % ({values})\n'.format(
+        args=''.join(name + ', ' for name in names),
+        values=''.join(field + ', ' for field in fields),
+    )
+    namespace = {'_format': ''.join(segments)}
+    exec(code, namespace)
+    render = namespace['render']
+    render.fields = tuple(names)
+    render.source = source
+    return render
+
+
+class TemplateRegistry(object):
+    # the compiled form of every *_template in a namespace, as attributes
+    # named without the _template suffix
+    def __init__(self, namespace):
+        self.sources = {}
+        for name, source in namespace.items():
+            if name.endswith('_template') and isinstance(source, basestring):
+                name = name[:-len('_template')]
+                self.sources[name] = source
+                setattr(self, name, compile_template(source))
+
+
+compiled = TemplateRegistry(globals())
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+import os
+import resource
+import threading
+import time
+
+
+# records where the pipeline spends its time. spans become complete events
+# in the Chrome trace event format (open the file in chrome://tracing or
+# ui.perfetto.dev) and are totalled per name for summary(). everything is a
+# no-op until enable() is called, so the hooks can stay in the hot paths;
+# callers guard anything costly to compute on tracing.enabled.
+enabled = False
+
+_events = []
+_totals = {}
+_counters = {}
+_lock = threading.Lock()
+_local = threading.local()
+_start = time.time()
+
+
+def enable():
+    global enabled, _start
+    enabled = True
+    _start = time.time()
+
+
+def _timestamp(t):
+    return int((t - _start) * 1e6)
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name, item=None, **args):
+    # times the enclosed block as one event named after item, or name when
+    # there is no item. events are totalled per name, and the slowest item
+    # of each name is kept for the summary. counts made while the span is
+    # open are added to its args.
+    if not enabled:
+        return _null_span
+    return _span(name, item, args)
+
+
+@contextmanager
+def _span(name, item, args):
+    stack = _local.__dict__.setdefault('stack', [])
+    counts = {}
+    stack.append(counts)
+    start = time.time()
+    try:
+        yield counts
+    finally:
+        end = time.time()
+        stack.pop()
+        args.update(counts)
+        rss = _rss_mb()
+        args['rss_mb'] = round(rss, 1)
+        if item is not None:
+            args['item'] = item
+        tid = threading.current_thread().ident
+        with _lock:
+            _events.append({'name': item or name, 'cat': name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                            'ts': _timestamp(start), 'dur': _timestamp(end) - _timestamp(start), 'args': args})
+            _events.append({'name': 'memory', 'ph': 'C', 'pid': os.getpid(), 'tid': tid,
+                            'ts': _timestamp(end), 'args': {'rss_mb': round(rss, 1)}})
+            total = _totals.setdefault(name, [0, 0.0, 0.0, None])
+            total[0] += 1
+            total[1] += end - start
+            if end - start >= total[2]:
+                total[2] = end - start
+                total[3] = item
+
+
+def count(name, n=1):
+    # adds n to a process wide counter and to the innermost open span
+    if not enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1][name] = stack[-1].get(name, 0) + n
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def write(path):
+    import json
+    with _lock:
+        trace = {
+            'traceEvents': list(_events),
+            'displayTimeUnit': 'ms',
+            'otherData': {'counters': dict(_counters)},
+        }
+    with open(path, 'w') as f:
+        json.dump(trace, f)
+
+
+def summary():
+    # a table of the spans, slowest total first, followed by the counters
+    header = '{name:<12} {count:>7} {total:>9} {mean:>9} {max:>9}  {slowest}'
+    row = '{name:<12} {count:>7} {total:>9.3f} {mean:>9.2f} {max:>9.2f}  {slowest}'
+    lines = [header.format(name='span', count='count', total='total s', mean='mean ms',
+                           max='max ms', slowest='slowest')]
+    with _lock:
+        totals = sorted(_totals.iteritems(), key=lambda entry: -entry[1][1])
+        counters = sorted(_counters.iteritems())
+    for name, (n, seconds, slowest_seconds, slowest) in totals:
+        lines.append(row.format(name=name, count=n, total=seconds, mean=seconds / n * 1000,
+                                max=slowest_seconds * 1000, slowest=slowest or ''))
+    for name, n in counters:
+        lines.append('{name:<30} {count:>12}'.format(name=name, count=n))
+    return '\n'.join(lines)
@@ -0,0 +1,156 @@
+import argparse
+import os
+import os.path
+import time
+
+from cache import BuildCache
+from quiet import gen_markdown, targets
+import sites
+
+
+# polls the sources of every target, the hand-written docs, the theme and
+# the site configs, and after each change reruns only what depends on it:
+# the extractor and renderer of a target whose submodule changed, then the
+# sites whose pages or embedded fragments changed. polling needs nothing
+# beyond the stdlib, and stat'ing the trees once a second is cheap next to
+# a doxygen run.
+
+
+scriptpath = os.path.dirname(os.path.realpath(__file__))
+
+
+def stamp(path):
+    # (mtime, size) of path, or None when it is gone
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def scan(root, exclude=()):
+    # stamps of every file below root, skipping hidden directories and the
+    # directories in exclude
+    stamps = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames
+                       if not d.startswith('.') and os.path.join(dirpath, d) not in exclude]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            path_stamp = stamp(path)
+            if path_stamp is not None:
+                stamps[path] = path_stamp
+    return stamps
+
+
+def changed_paths(old, new):
+    return set(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+
+
+def _under(path, directory):
+    return path.startswith(os.path.join(directory, ''))
+
+
+class Watcher(object):
+    def __init__(self, root, config_paths, cache=None):
+        self.root = os.path.abspath(root)
+        self.cache = cache
+        self.docs_path = os.path.join(self.root, 'docs')
+        self.theme_path = os.path.join(self.root, 'theme')
+        self.sites = dict((os.path.abspath(config_path), sites.site_paths(config_path))
+                          for config_path in config_paths)
+        # the configs loaded for in process builds, by config path
+        self.configs = {}
+        # a target is regenerated when its submodule changes, apart from the
+        # doxygen output the extractor itself writes below it
+        self.sources = dict((name, os.path.join(self.root, subdir))
+                            for name, (load_docs, gen, subdir) in targets.iteritems())
+        self.stamps = self.scan()
+
+    def scan(self):
+        stamps = {}
+        for source in self.sources.itervalues():
+            stamps.update(scan(source, exclude=(os.path.join(source, 'docs'),)))
+        stamps.update(scan(self.docs_path))
+        stamps.update(scan(self.theme_path))
+        for config_path in self.sites:
+            stamps.update(scan(os.path.dirname(config_path)))
+        return stamps
+
+    def affected_targets(self, paths):
+        return [name for name, source in self.sources.iteritems()
+                if any(_under(path, source) for path in paths)]
+
+    def affected_sites(self, paths):
+        # every site shares the pages and assets in its docs_dir, while the
+        # fragments under a site's embed directory belong to that site only
+        affected = set()
+        for path in paths:
+            for config_path, site in self.sites.iteritems():
+                if path == config_path or _under(path, site['fragments_dir']):
+                    affected.add(config_path)
+                elif any(_under(path, theme_dir) for theme_dir in site['theme_dir']):
+                    affected.add(config_path)
+                elif _under(path, site['docs_dir']) and not any(
+                        _under(path, other['fragments_dir']) for other in self.sites.itervalues()):
+                    affected.add(config_path)
+        return sorted(affected)
+
+    def rebuild(self, paths):
+        names = self.affected_targets(paths)
+        if names:
+            print('regenerating ' + ', '.join(names))
+            written = set(os.path.abspath(page) for page in gen_markdown(self.root, names=names, cache=self.cache))
+            # the pages the renderers wrote are this rebuild's own doing,
+            # not edits for the next poll to react to
+            for page in written:
+                page_stamp = stamp(page)
+                if page_stamp is not None:
+                    self.stamps[page] = page_stamp
+            paths = paths | written
+
+        for config_path in self.affected_sites(paths):
+            if config_path in paths:
+                self.sites[config_path] = sites.site_paths(config_path)
+                self.configs.pop(config_path, None)
+            print('building ' + os.path.relpath(config_path, self.root))
+            if not sites.in_process:
+                # another mkdocs than the one build_site drives
+                sites.build_site_with_mkdocs(config_path)
+                continue
+            if config_path not in self.configs:
+                self.configs[config_path] = sites.load_site(config_path)
+            sites.build_site(self.configs[config_path])
+
+    def poll(self):
+        stamps = self.scan()
+        paths = changed_paths(self.stamps, stamps)
+        # the scan taken before the rebuild is kept, so anything saved while
+        # doxygen, jsdoc or mkdocs runs is a change to the next poll, even
+        # when the rebuild fails; rebuild() adds the pages it writes itself
+        self.stamps = stamps
+        if paths:
+            self.rebuild(paths)
+        return paths
+
+    def run(self, interval=1.0):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                # a broken edit should not stop the watcher; the next save
+                # gets another try
+                print('build failed: {error}'.format(error=e))
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the API reference and rebuild the sites as their sources change.')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between polls (default: 1)')
+    args = parser.parse_args()
+
+    root = os.path.join(scriptpath, '..')
+    watcher = Watcher(root, [os.path.join(sites.site_configs_path, name) for name in sites.default_sites],
+                      cache=BuildCache(os.path.join(root, '.doxydown-cache')))
+    watcher.run(interval=args.interval)
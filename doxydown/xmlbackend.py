@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import os
+
+
+# the XML libraries DoxygenXMLConsumer can parse with. all of them hand
+# back elements with the ElementTree API (find, iterfind, attrib, text,
+# tail, iteration over children), so the consumer reads them all the same
+# way, and $DOXYDOWN_XML_BACKEND picks one by name. cElementTree is the
+# default, and the pure python ElementTree, two to three times as slow, is
+# only used where it was not built. lxml is optional and only used when
+# asked for by name: it goes through the same element walk as the others,
+# and comes out behind cElementTree in bench.py's doxygen.parse.* phases.
+# bench.py also checks that every installed backend parses its synthetic
+# XML alike.
+
+
+class ElementTreeBackend(object):
+    def __init__(self, name, et):
+        self.name = name
+        self._et = et
+
+    def parse(self, path):
+        return self._et.parse(path).getroot()
+
+    def _iterparse(self, source):
+        return self._et.iterparse(source, events=('start', 'end'))
+
+    def iter_compounds(self, source, keep):
+        # yields each memberdef of a compounddef's sectiondefs as soon as its
+        # end tag is seen, then the compounddef itself, for every compounddef
+        # in source. memberdefs and compounddefs are dropped from the tree
+        # once the caller is done with them, and every other child of a
+        # compounddef whose tag is not in keep is dropped piece by piece as
+        # it is parsed, so the program listings, member lists and graphs
+        # doxygen writes for a compound never pile up, and memory stays flat
+        # however large the compound is. an element is removed at the event
+        # after its end, once the parser is done with its tail, and by
+        # identity, as the parser may have added its next siblings by then.
+        stack = []
+        dropped = []
+        for event, element in self._iterparse(source):
+            for parent, child in dropped:
+                parent.remove(child)
+            del dropped[:]
+            if event == 'start':
+                stack.append(element)
+                continue
+            stack.pop()
+            if element.tag == 'memberdef':
+                if (len(stack) == 3 and stack[-1].tag == 'sectiondef' and
+                        stack[-2].tag == 'compounddef'):
+                    yield element
+                    dropped.append((stack[-1], element))
+            elif element.tag == 'compounddef' and len(stack) == 1:
+                yield element
+                dropped.append((stack[-1], element))
+            elif len(stack) >= 2 and stack[1].tag == 'compounddef':
+                child = stack[2] if len(stack) > 2 else element
+                # a sectiondef is only dropped once it ends, as the
+                # memberdefs below it are still to be yielded
+                if child.tag not in keep and (child is element or child.tag != 'sectiondef'):
+                    dropped.append((stack[-1], element))
+
+
+class LxmlBackend(ElementTreeBackend):
+    def __init__(self, etree):
+        ElementTreeBackend.__init__(self, 'lxml', etree)
+        # comments and processing instructions would show up as children,
+        # which ElementTree never has
+        self._parser = etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+
+    def parse(self, path):
+        return self._et.parse(path, self._parser).getroot()
+
+    def _iterparse(self, source):
+        return self._et.iterparse(source, events=('start', 'end'), remove_comments=True,
+                                  remove_pis=True, huge_tree=True)
+
+
+def _load_lxml():
+    from lxml import etree
+    return LxmlBackend(etree)
+
+
+def _load_celementtree():
+    import xml.etree.cElementTree as ET
+    return ElementTreeBackend('cElementTree', ET)
+
+
+def _load_elementtree():
+    import xml.etree.ElementTree as ET
+    return ElementTreeBackend('ElementTree', ET)
+
+
+_loaders = OrderedDict((
+    ('cElementTree', _load_celementtree),
+    ('lxml', _load_lxml),
+    ('ElementTree', _load_elementtree),
+))
+# the backends used when none is named, in order of preference
+_defaults = ('cElementTree', 'ElementTree')
+_backends = {}
+
+
+def get_backend(name=None):
+    # the named backend, or the preferred default one installed
+    name = name or os.environ.get('DOXYDOWN_XML_BACKEND')
+    if not name:
+        available_names = available()
+        return get_backend(next(name for name in _defaults if name in available_names))
+    if name not in _loaders:
+        raise ValueError('unknown XML backend ' + name + ', expected one of ' + ', '.join(_loaders))
+    if name not in _backends:
+        _backends[name] = _loaders[name]()
+    return _backends[name]
+
+
+def known():
+    return list(_loaders)
+
+
+def available():
+    names = []
+    for name in _loaders:
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names